@@ -1,14 +1,51 @@
 from dash import Dash
 from dash_bootstrap_components.themes import BOOTSTRAP
+from flask import jsonify
 import config
 from src.layout import create_layout
 from src.callbacks import register_callbacks
+from src.data_loader import registry, initialise_data, readiness
+from src.geojson_assets import register_geojson_route
+from src.export import register_export_route
+from src.refresh import DataWatcher
+from src.metrics import instrument_app
+from src.transport import register_transport
 
-app = Dash(__name__, external_stylesheets=[BOOTSTRAP, "https://use.fontawesome.com/releases/v5.8.1/css/all.css"])
-app.config.suppress_callback_exceptions = True
+def create_app():
+    # Builds the Dash app without touching the data, so a server can bind its port straight away.
+    # The data starts loading in the background on the first request of each process, unless
+    # initialise_data() was called before (gunicorn.conf.py does it when a worker starts)
+    app = Dash(__name__, external_stylesheets=[BOOTSTRAP, "https://use.fontawesome.com/releases/v5.8.1/css/all.css"])
+    app.config.suppress_callback_exceptions = True
 
-app.layout = create_layout()
-register_callbacks(app)
+    # A function layout picks up dates added by a data refresh on the next page load
+    app.layout = create_layout
+    if config.METRICS_ENABLED:
+        instrument_app(app)
+    register_callbacks(app)
+    register_geojson_route(app.server, registry)
+    register_export_route(app.server, registry)
+
+    if config.COMPRESSION_ENABLED:
+        register_transport(app)
+
+    @app.server.route(config.READY_ROUTE)
+    def ready():
+        status = readiness()
+        return jsonify(status), 200 if status['ready'] else 503
+
+    # Any server running wsgi:server (uwsgi, or gunicorn without gunicorn.conf.py) loads the data this way
+    @app.server.before_request
+    def start_loading():
+        initialise_data(background=True)
+
+    if config.DATA_WATCH_INTERVAL:
+        data_watcher = DataWatcher(registry, config.DATA_WATCH_INTERVAL)
+        app.server.before_request(data_watcher.start)
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
-    app.run_server(debug=config.DEBUG)
\ No newline at end of file
+    initialise_data()
+    app.run_server(debug=config.DEBUG)
@@ -0,0 +1,48 @@
+/* assets/clientside.js */
+
+/* Callbacks that only move values between components run here instead of on the server */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        copy_value: function(value) {
+            return value;
+        },
+
+        toggle_modal: function(clickData, is_open) {
+            if (clickData) {
+                return [!is_open, clickData.points[0].location];
+            }
+            return [is_open, null];
+        },
+
+        /* The store holds the price and the rating figure, the buttons pick one without a request */
+        show_series: function(series, n_clicks_price, n_clicks_rating) {
+            if (!series) {
+                return [{data: [], layout: {}}, ""];
+            }
+            var rating = n_clicks_rating > n_clicks_price;
+            var figure = rating ? series.rating : series.price;
+            var layout = Object.assign({}, figure.layout, {template: series.template});
+            return [{data: figure.data, layout: layout}, rating ? "Rating Over Time" : "Price Over Time"];
+        },
+
+        /* Export URLs for the table's selection (every neighbourhood while none is picked), or the whole city */
+        export_links: function(city, date_index, sort_by, columns, n_clicks_asc, n_clicks_desc, neighbourhood, scope, marks, route) {
+            if (!city || !marks || !(date_index in marks)) {
+                return ["", ""];
+            }
+            var bulk = scope && scope.indexOf("all") !== -1;
+            var params = [
+                "city=" + encodeURIComponent(city),
+                "month=" + (bulk ? "all" : parseInt(marks[date_index].split("-")[1], 10)),
+                "sort=" + encodeURIComponent(sort_by || "review_scores_rating"),
+                "order=" + (n_clicks_asc > n_clicks_desc ? "asc" : "desc"),
+                "columns=" + encodeURIComponent((columns || []).join(","))
+            ];
+            if (!bulk && neighbourhood) {
+                params.push("neighbourhood=" + encodeURIComponent(neighbourhood));
+            }
+            var query = "?" + params.join("&");
+            return [route + "listings.csv" + query, route + "listings.parquet" + query];
+        }
+    }
+});
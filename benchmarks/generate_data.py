@@ -0,0 +1,99 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import config
+
+# Synthetic listings in the layout of the *_final_data.csv files, paired with the real neighbourhood
+# GeoJSON so the map joins work. Every listing appears once per month, like the monthly scrapes.
+
+AMENITIES = ['Wifi', 'Kitchen', 'Essentials', 'Hair dryer', 'Hangers', 'Heating', 'Washer', 'Air conditioning',
+             'Iron', 'Hot water', 'Dishes and silverware', 'Refrigerator', 'Microwave', 'Elevator', 'TV']
+CATEGORIES = ['Cozy', 'Luxury', 'Budget', 'Family', 'Business']
+HOST_NAMES = ['Ana', 'Luis', 'Marta', 'Jose Maria', 'Giulia', 'Marco', 'Joao', 'Sofia', 'Pierre', 'Elena']
+GAP_COLUMNS = ['review_scores_rating', 'reviews_per_month', 'host_total_listings_count', 'Positivity_Score(1to5)']
+GAP_FRACTION = 0.05
+
+def neighbourhood_names(geojson_path, limit=None):
+    with open(geojson_path, 'r') as file:
+        geojson = json.load(file)
+    names = [feature['properties']['neighbourhood'] for feature in geojson['features']]
+    return names[:limit] if limit else names
+
+def amenities_text(rng, listings):
+    chosen = rng.choice(AMENITIES, size=10, replace=False)
+    percentages = np.sort(rng.uniform(20, 99, size=10))[::-1]
+    return ', '.join(f'{name} ({int(listings * p / 100)}, {p:.1f}%)' for name, p in zip(chosen, percentages))
+
+def generate_city(listings_path, geojson_path, rows, neighbourhoods=None, months=12, start='2023-09-01', seed=0):
+    rng = np.random.default_rng(seed)
+    names = np.array(neighbourhood_names(geojson_path, neighbourhoods))
+    dates = pd.date_range(start, periods=months, freq='MS')
+    count = math.ceil(rows / months)
+
+    # Fixed per-listing attributes, skewed so some neighbourhoods are much larger than others
+    weights = rng.pareto(1.5, len(names)) + 1
+    neighbourhood = rng.choice(len(names), size=count, p=weights / weights.sum())
+    listing_ids = rng.permutation(10 ** 17 + np.arange(count, dtype=np.int64) * 1000 + rng.integers(0, 1000, size=count))
+    host_ids = rng.integers(1, 5 * 10 ** 8, size=count // 3 + 1)[rng.integers(0, count // 3 + 1, size=count)]
+    host_listings = rng.integers(1, 50, size=count).astype(float)
+    base_price = rng.gamma(2.0, 60.0, size=count)
+    base_rating = rng.uniform(3.0, 5.0, size=count)
+    amenities = np.array([amenities_text(rng, int(size)) for size in np.bincount(neighbourhood, minlength=len(names))])
+    listing = pd.DataFrame({
+        'neighbourhood_cleansed': names[neighbourhood],
+        'name': [f'Listing {i}' for i in range(count)],
+        'id': listing_ids,
+        'host_name': rng.choice(HOST_NAMES, size=count),
+        'host_id': host_ids,
+        'host_total_listings_count': host_listings,
+        'top_amenities_with_percentages': amenities[neighbourhood],
+        'category': rng.choice(CATEGORIES, size=count),
+    })
+
+    # Written one month at a time so a few million rows never sit in memory at once
+    reviews = rng.integers(0, 300, size=count)
+    for i, date in enumerate(dates):
+        month = listing.copy()
+        if i == len(dates) - 1 and count * months > rows:
+            month = month.iloc[:rows - count * (months - 1)]
+        size = len(month)
+        seasonal = 1 + 0.15 * np.sin(2 * np.pi * (date.month - 4) / 12)
+        reviews = reviews + rng.poisson(1.5, size=count)
+        month.insert(0, 'date', date.strftime('%Y-%m-%d'))
+        month.insert(1, 'price', np.round(base_price[:size] * seasonal * rng.uniform(0.9, 1.1, size=size), 2))
+        month.insert(3, 'review_scores_rating', np.round(np.clip(base_rating[:size] + rng.normal(0, 0.05, size=size), 0, 5), 2))
+        month['number_of_reviews'] = reviews[:size]
+        month['reviews_per_month'] = np.round(rng.uniform(0, 5, size=size), 2)
+        month['Positivity_Score(1to5)'] = np.round(rng.uniform(1, 5, size=size), 2)
+        # The real data leaves these blank for some listings, e.g. ones not reviewed yet
+        for col in GAP_COLUMNS:
+            month[col] = month[col].mask(rng.random(size) < GAP_FRACTION)
+        month.to_csv(listings_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+
+def generate(output_dir, cities, rows, neighbourhoods=None, months=12, start='2023-09-01', seed=0):
+    os.makedirs(output_dir, exist_ok=True)
+    for i, city in enumerate(cities):
+        paths = config.CITY_PATHS[city]
+        listings_path = os.path.join(output_dir, os.path.basename(paths['listings']))
+        geojson_path = os.path.join(output_dir, os.path.basename(paths['geojson']))
+        shutil.copyfile(paths['geojson'], geojson_path)
+        generate_city(listings_path, geojson_path, rows, neighbourhoods, months, start, seed + i)
+        print(f"{city}: {rows} rows, {len(neighbourhood_names(geojson_path, neighbourhoods))} neighbourhoods, "
+              f"{months} months -> {listings_path} ({os.path.getsize(listings_path) / 1e6:.0f} MB)")
+
+if __name__ == '__main__':
+    cities_with_geometry = [city for city, paths in config.CITY_PATHS.items() if os.path.exists(paths['geojson'])]
+    parser = argparse.ArgumentParser(description="Generate synthetic listings CSVs for benchmarking")
+    parser.add_argument('--output', default='benchmarks/data', help="directory for the generated files")
+    parser.add_argument('--rows', type=int, default=100000, help="listing rows per city")
+    parser.add_argument('--neighbourhoods', type=int, help="use only the first N neighbourhoods of each GeoJSON")
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--start', default='2023-09-01', help="first month of data")
+    parser.add_argument('--cities', nargs='+', default=cities_with_geometry[:2], choices=cities_with_geometry)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.output, args.cities, args.rows, args.neighbourhoods, args.months, args.start, args.seed)
@@ -0,0 +1,75 @@
+import argparse
+import json
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+# Startup import profile from `python -X importtime`, summed per top-level package.
+#
+#   python -m benchmarks.importtime --output imports.json
+#   python -m benchmarks.importtime --compare imports.json
+
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+def profile(module):
+    # Run in a fresh interpreter so nothing is imported already
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            check=True, capture_output=True, text=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append({'module': name, 'self_ms': int(self_us) / 1000, 'cumulative_ms': int(cumulative_us) / 1000,
+                            'depth': len(indent) // 2})
+    return imports
+
+def summarize(module, imports, top):
+    packages = defaultdict(float)
+    for entry in imports:
+        packages[entry['module'].split('.')[0]] += entry['self_ms']
+    total = sum(entry['cumulative_ms'] for entry in imports if entry['depth'] == 0)
+    return {
+        'module': module,
+        'total_ms': round(total, 1),
+        'packages': {name: round(ms, 1) for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+        # Direct imports of the project's own modules show which of them pull in the heavy dependencies
+        'project_modules': {entry['module']: round(entry['cumulative_ms'], 1) for entry in imports
+                            if entry['module'].split('.')[0] in ('app', 'config', 'src')},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the imports done when the app starts")
+    parser.add_argument('--module', default='app', help="module to import")
+    parser.add_argument('--top', type=int, default=20, help="packages to list")
+    parser.add_argument('--repeat', type=int, default=3, help="imports to run, the fastest one is reported")
+    parser.add_argument('--output', help="write the profile as JSON to this file")
+    parser.add_argument('--compare', help="JSON profile of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="total import time ratio reported as a regression")
+    args = parser.parse_args()
+
+    runs = [summarize(args.module, profile(args.module), args.top) for _ in range(args.repeat)]
+    result = min(runs, key=lambda run: run['total_ms'])
+
+    print(f"import {args.module}: {result['total_ms']:.0f} ms (fastest of {args.repeat})")
+    for name, ms in result['packages'].items():
+        print(f"    {name:<35} {ms:8.1f} ms")
+    print("Project modules (cumulative):")
+    for name, ms in sorted(result['project_modules'].items(), key=lambda item: -item[1]):
+        print(f"    {name:<35} {ms:8.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+        print(f"Profile written to {args.output}")
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        ratio = result['total_ms'] / baseline['total_ms']
+        print(f"Compared with {args.compare}: {baseline['total_ms']:.0f} -> {result['total_ms']:.0f} ms ({ratio:.2f}x)")
+        if ratio > args.threshold:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
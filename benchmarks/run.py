@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Times startup, data loading and every Dash callback against a generated dataset
+# (python -m benchmarks.generate_data first). Callbacks are called directly, without a browser.
+#
+#   python -m benchmarks.run --data benchmarks/data --output results.json
+#   python -m benchmarks.run --data benchmarks/data --compare results.json
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def process_memory_mb():
+    # PSS splits every shared page between the processes mapping it, so it adds up across workers
+    sizes = {}
+    with open('/proc/self/smaps_rollup', 'r') as file:
+        for line in file:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss', 'Shared_Clean', 'Private_Dirty'):
+                sizes[key.lower()] = round(int(value.split()[0]) / 1024, 1)
+    return sizes
+
+def configure(data_dir, cache_dir):
+    # Must run before the app modules are imported, they read the city paths at import time
+    import config
+    config.DEBUG = False
+    config.DATASET_DIR = data_dir
+    config.CACHE_DIR = cache_dir
+    config.CITY_PATHS = {
+        city: {key: os.path.join(data_dir, os.path.basename(path)) for key, path in paths.items()}
+        for city, paths in config.CITY_PATHS.items()
+        if os.path.exists(os.path.join(data_dir, os.path.basename(paths['listings'])))
+    }
+    if not config.CITY_PATHS:
+        sys.exit(f"No generated listings found in {data_dir}, run python -m benchmarks.generate_data first")
+    config.PRELOAD_CITIES = [city for city in config.PRELOAD_CITIES if city in config.CITY_PATHS] or list(config.CITY_PATHS)[:1]
+    return config
+
+def payload_size(result):
+    import plotly
+    return len(json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder))
+
+def summarize(times, result=None, measure_payload=True):
+    times = np.array(times) * 1000
+    summary = {
+        'runs': len(times),
+        'p50_ms': round(float(np.percentile(times, 50)), 3),
+        'p95_ms': round(float(np.percentile(times, 95)), 3),
+        'mean_ms': round(float(times.mean()), 3),
+        'min_ms': round(float(times.min()), 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if measure_payload and result is not None:
+        summary['payload_bytes'] = payload_size(result)
+    return summary
+
+def bench(fn, repeat, warmup=1, setup=None, measure_payload=True):
+    # fn gets the run number so inputs can vary between runs; warmup runs are not timed
+    times = []
+    result = None
+    for i in range(warmup + repeat):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        result = fn(i)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    return summarize(times, result, measure_payload)
+
+def report(name, summary, results):
+    results[name] = summary
+    payload = f", {summary['payload_bytes'] / 1e3:.1f} KB" if 'payload_bytes' in summary else ''
+    print(f"{name:<45} p50 {summary['p50_ms']:>10.2f} ms  p95 {summary['p95_ms']:>10.2f} ms  "
+          f"peak RSS {summary['peak_rss_mb']:>7.1f} MB{payload}")
+
+def probe_startup(args):
+    configure(args.data, args.cache)
+    start = time.perf_counter()
+    import app  # noqa: F401
+    imported = time.perf_counter()
+    from src.data_loader import initialise_data
+    initialise_data()
+    print(json.dumps({'seconds': time.perf_counter() - start, 'import_seconds': imported - start, 'peak_rss_mb': peak_rss_mb()}))
+
+def bench_startup(args, results):
+    # Every start runs in a fresh interpreter; cold starts parse the CSVs, warm starts read the cache
+    def start(cache_dir):
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.run', '--data', args.data, '--cache', cache_dir, '--probe-startup'],
+                                check=True, capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def start_cold():
+        with tempfile.TemporaryDirectory() as cache_dir:
+            return start(cache_dir)
+
+    cold = [start_cold() for _ in range(args.startup_repeat)]
+    start(args.cache)  # fills the cache for the warm starts
+    warm = [start(args.cache) for _ in range(args.startup_repeat)]
+    # 'import app' is the time until a server could bind its port, before any data is loaded
+    for name, key, runs in (('import app', 'import_seconds', cold + warm), ('startup (cold cache)', 'seconds', cold), ('startup (warm cache)', 'seconds', warm)):
+        summary = summarize([run[key] for run in runs])
+        summary['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+        report(name, summary, results)
+
+def measure_worker(barrier, queue):
+    from src.data_loader import initialise_data
+    initialise_data()
+    barrier.wait()  # every worker holds its data before any is measured
+    queue.put(process_memory_mb())
+    barrier.wait()  # and none exits while the others are measured
+
+def probe_workers(args):
+    # Forks workers from a process that imported the app, as gunicorn's preload_app does
+    import multiprocessing
+    config = configure(args.data, args.cache)
+    config.SHARED_DATASET = args.probe_workers == 'shared'
+    from src.listings_cache import build_cache
+    import app  # noqa: F401
+    build_cache(config.CITY_PATHS)
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(args.worker_processes)
+    queue = context.Queue()
+    workers = [context.Process(target=measure_worker, args=(barrier, queue)) for _ in range(args.worker_processes)]
+    for worker in workers:
+        worker.start()
+    sizes = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    print(json.dumps(sizes))
+
+def bench_workers(args):
+    # Memory per worker while args.worker_processes workers hold the preloaded cities, with and without SHARED_DATASET
+    memory = {}
+    for mode in ('private', 'shared'):
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.run', '--data', args.data, '--cache', args.cache,
+                                 '--worker-processes', str(args.worker_processes), '--probe-workers', mode],
+                                check=True, capture_output=True, text=True).stdout
+        sizes = json.loads(output.strip().splitlines()[-1])
+        memory[mode] = {key: round(max(size[key] for size in sizes), 1) for key in sizes[0]}
+        print(f"{args.worker_processes} workers ({mode} dataset){'':<{21 - len(mode)}} PSS {memory[mode]['pss']:>7.1f} MB  "
+              f"RSS {memory[mode]['rss']:>7.1f} MB  shared clean {memory[mode]['shared_clean']:>7.1f} MB  "
+              f"private dirty {memory[mode]['private_dirty']:>7.1f} MB per worker")
+    return memory
+
+def sample_inputs(config, city, listings, date_marks, run):
+    # Inputs cycle through months and neighbourhoods, so cached results are only reused as often as in real use
+    neighbourhoods = sorted(listings['neighbourhood_cleansed'].unique())
+    neighbourhood = neighbourhoods[run % len(neighbourhoods)]
+    return {
+        'city-dropdown.value': city,
+        'month-slider.value': sorted(date_marks)[run % len(date_marks)],
+        'sort-dropdown.value': ['price', 'review_scores_rating', 'number_of_reviews'][run % 3],
+        'columns-dropdown.value': config.ADDITIONAL_COLUMNS_LIST[:2],
+        'order-asc.n_clicks': run % 2,
+        'order-desc.n_clicks': 0,
+        'neighborhood-dropdown.value': neighbourhood,
+        'listings-table.page_current': 0,
+        'clicked-neighborhood.data': neighbourhood,
+        'map.clickData': {'points': [{'location': neighbourhood}]},
+        'modal.is_open': False,
+        'price-over-time.n_clicks': run % 2,
+        'rating-over-time.n_clicks': 0,
+        'comparison-cities.value': list(config.CITY_PATHS),
+        'search-input.value': ['listing', 'listing 12', 'listing 123'][run % 3],
+        'search-rank.value': ['review_scores_rating', 'number_of_reviews'][run % 2],
+    }
+
+def bench_callbacks(args, config, results):
+    from dash._callback_context import context_value
+    from dash._utils import AttributeDict
+    from app import app
+
+    from src import data_loader
+    city = args.city or config.PRELOAD_CITIES[0]
+    city_data = data_loader.registry.get(city)
+    listings = city_data.listings_data
+
+    for output, spec in app.callback_map.items():
+        if 'callback' not in spec:
+            continue  # clientside callbacks run in the browser
+        callback = spec['callback']
+        function = getattr(callback, '__wrapped__', callback)
+        props = [f"{item['id']}.{item['property']}" for item in spec['inputs'] + spec['state']]
+        name = f'callback {function.__name__}'
+        if name in results:
+            name = f'{name} [{output}]'
+
+        def run(i, function=function, props=props):
+            values = sample_inputs(config, city, listings, data_loader.date_marks, i)
+            missing = [prop for prop in props if prop not in values]
+            if missing:
+                raise KeyError(f"No sample value for {', '.join(missing)}")
+            return function(*[values[prop] for prop in props])
+
+        def trigger(i, props=props):
+            context_value.set(AttributeDict(triggered_inputs=[{'prop_id': props[0], 'value': None}]))
+
+        try:
+            report(name, bench(run, args.repeat, setup=trigger), results)
+        except KeyError as e:
+            print(f"{name}: skipped, {e.args[0]}")
+
+def bench_functions(args, config, results):
+    from src.data_loader import load_data, registry, date_marks, initialise_data
+    from src.listings_cache import build_cache
+    from src.utils import get_unique_dates, update_map, generate_table, to_display_values
+
+    build_cache(config.CITY_PATHS)
+    initialise_data()
+    warm_cache = config.CACHE_DIR
+    with tempfile.TemporaryDirectory() as empty_cache:
+        # Pointing the cache at an empty directory without writing it back forces the CSV path
+        config.CACHE_DIR, config.CACHE_WRITE_ON_MISS = empty_cache, False
+        report('load_data (csv)', bench(lambda i: load_data(config.CITY_PATHS, config.LOAD_WORKERS), args.load_repeat, warmup=0, measure_payload=False), results)
+        report('get_unique_dates (csv)', bench(lambda i: get_unique_dates(config.CITY_PATHS), args.repeat, measure_payload=False), results)
+        config.CACHE_DIR, config.CACHE_WRITE_ON_MISS = warm_cache, True
+    report('load_data (cache)', bench(lambda i: load_data(config.CITY_PATHS, config.LOAD_WORKERS), args.load_repeat, warmup=0, measure_payload=False), results)
+    report('get_unique_dates (manifest)', bench(lambda i: get_unique_dates(config.CITY_PATHS), args.repeat, measure_payload=False), results)
+
+    city = args.city or config.PRELOAD_CITIES[0]
+    city_data = registry.get(city)
+    months = sorted(city_data.neighborhood_stats['month'].unique())
+    geojson = {city: city_data.neighborhoods_geojson}
+    stats = {city: city_data.neighborhood_stats}
+    report('update_map', bench(lambda i: update_map(city, int(months[i % len(months)]), False, config.CITY_PATHS, geojson, stats), args.repeat), results)
+
+    index = city_data.listings_index
+    partitions = sorted(index.ranges, key=lambda key: index.size(*key), reverse=True)
+    columns = list(dict.fromkeys(config.DEFAULT_COLUMNS + config.ADDITIONAL_COLUMNS_LIST))
+
+    def table(i):
+        neighbourhood, month = partitions[i % min(len(partitions), 10)]
+        rows = index.sorted_rows(neighbourhood, month, 'price', False, columns, 0, config.TABLE_TOP_K)
+        return generate_table(to_display_values(rows))
+    report('generate_table (largest partitions)', bench(table, args.repeat), results)
+
+    return {
+        'cities': list(config.CITY_PATHS),
+        'rows': {name: len(data.listings_data) for name, data in registry.resident().items()},
+        'neighbourhoods': int(city_data.listings_data['neighbourhood_cleansed'].nunique()),
+        'dates': len(date_marks),
+    }
+
+def compare(baseline_path, results, threshold, min_delta_ms):
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)['results']
+    regressions = []
+    print(f"\nCompared with {baseline_path} (p50, regression above {threshold:.2f}x)")
+    for name, summary in results.items():
+        if name not in baseline:
+            continue
+        ratio = summary['p50_ms'] / baseline[name]['p50_ms'] if baseline[name]['p50_ms'] else float('inf')
+        # Sub-millisecond callbacks jitter by more than the threshold, so small absolute changes are ignored
+        regressed = ratio > threshold and summary['p50_ms'] - baseline[name]['p50_ms'] > min_delta_ms
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{name:<45} {baseline[name]['p50_ms']:>10.2f} -> {summary['p50_ms']:>10.2f} ms  {ratio:>5.2f}x{flag}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark startup, data loading and callbacks")
+    parser.add_argument('--data', default='benchmarks/data', help="directory written by benchmarks.generate_data")
+    parser.add_argument('--cache', help="listings cache directory, a temporary one by default")
+    parser.add_argument('--city', help="city whose callbacks are timed, the first preloaded one by default")
+    parser.add_argument('--repeat', type=int, default=30, help="timed runs per function and callback")
+    parser.add_argument('--load-repeat', type=int, default=3, help="timed runs of load_data")
+    parser.add_argument('--startup-repeat', type=int, default=3, help="interpreter starts per startup benchmark, 0 to skip")
+    parser.add_argument('--worker-processes', type=int, default=4, help="forked workers whose memory is measured, 0 to skip")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="p50 ratio reported as a regression")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help="smallest p50 increase reported as a regression")
+    parser.add_argument('--probe-startup', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--probe-workers', choices=['private', 'shared'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe_startup:
+        probe_startup(args)
+        return
+    if args.probe_workers:
+        probe_workers(args)
+        return
+
+    with tempfile.TemporaryDirectory() as temporary_cache:
+        args.cache = args.cache or temporary_cache
+        results = {}
+        if args.startup_repeat > 0:
+            bench_startup(args, results)
+        config = configure(args.data, args.cache)
+        dataset = bench_functions(args, config, results)
+        bench_callbacks(args, config, results)
+        # Needs /proc/self/smaps_rollup, i.e. Linux
+        memory = bench_workers(args) if args.worker_processes > 0 and os.path.exists('/proc/self/smaps_rollup') else None
+
+    import dash
+    import pandas as pd
+    output = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'pandas': pd.__version__,
+            'dash': dash.__version__,
+        },
+        'dataset': dataset,
+        'results': results,
+        'worker_memory_mb': memory,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare and compare(args.compare, results, args.threshold, args.min_delta_ms):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
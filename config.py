@@ -5,6 +5,105 @@ DATASET_DIR = 'data/'
 
 DEBUG = True
 
+# Columnar cache of the listings CSVs, built by `python -m src.listings_cache`
+CACHE_DIR = os.path.join(DATASET_DIR, 'cache')
+CACHE_COMPRESSION = 'uncompressed'  # uncompressed Feather files can be memory-mapped without a copy
+CACHE_WRITE_ON_MISS = True
+CACHE_VERIFY_HASH = False  # also store a SHA-1 of the CSV so a touched but unchanged file stays cached
+# Numeric listings columns and the codes of text columns become read-only views into the memory-mapped
+# cache files, shared by every worker through the OS page cache. The text values, aggregates, indexes and
+# forecasts are still built per worker (turned on by wsgi.py; benchmarks.run measures per-worker PSS)
+SHARED_DATASET = False
+
+# Cities are loaded on first selection; least recently used ones are dropped beyond these limits
+MAX_RESIDENT_CITIES = 3
+MAX_RESIDENT_BYTES = None  # e.g. 1.5e9 to cap resident listings at ~1.5 GB instead of a city count
+PRELOAD_CITIES = ['Madrid, Spain']  # the default selection of the city dropdown
+LOAD_WORKERS = None  # processes parsing the CSVs of uncached cities on preload, None for one per CPU, 1 to parse serially
+READY_ROUTE = '/ready'  # 200 once the preloaded cities are in memory, 503 before
+READY_WAIT_SECONDS = 20  # how long a page load waits for the data before showing a loading message
+INIT_RETRY_SECONDS = 5  # wait before a failed initial load is retried, doubled after every further failure
+INIT_RETRY_MAX_SECONDS = 300
+DATA_WATCH_INTERVAL = None  # seconds between checks for changed data files, None to only read them at startup
+
+# Built map figures are cached per (city, month, forecast flag); set a directory or Redis URL to share them across workers
+MAP_CACHE_SIZE = 64
+MAP_CACHE_DIR = None  # e.g. os.path.join(CACHE_DIR, 'figures')
+MAP_CACHE_REDIS_URL = None  # e.g. 'redis://localhost:6379/0'
+
+# Opt-in per-callback timings and cache counts, served in Prometheus text format on METRICS_ROUTE
+METRICS_ENABLED = False
+METRICS_ROUTE = '/metrics'
+SLOW_CALLBACK_MS = None  # e.g. 500 to print callbacks slower than this with their phases and inputs (needs METRICS_ENABLED)
+
+# Opt-in gzip (or brotli, when installed) compression of responses, with ETags and long-lived caching of assets
+COMPRESSION_ENABLED = False
+COMPRESSION_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSED_CACHE_SIZE = 256  # compressed bodies kept by content hash, so repeated responses are compressed once
+ASSET_MAX_AGE = 31536000  # seconds, for assets requested with Dash's ?m=<mtime> cache-busting query
+
+# 'url' ships each city's geometry once as a cacheable asset, 'inline' embeds it in every map response
+MAP_GEOJSON_MODE = 'url'
+GEOJSON_ROUTE = '/geojson/'
+
+# Geometry preprocessing, built by `python -m src.geometry`
+GEOJSON_USE_SIMPLIFIED = True  # load the simplified files from CACHE_DIR when they are up to date
+GEOJSON_SIMPLIFY_TOLERANCE = 0.0001  # degrees, roughly 10 m
+GEOJSON_PRECISION = 5  # decimal places, roughly 1 m
+
+# 'paged' sorts and pages the listings table on the server and only sends the visible rows,
+# 'figure' renders every filtered listing into a go.Table
+TABLE_MODE = 'paged'
+TABLE_PAGE_SIZE = 25
+TABLE_TOP_K = 500  # rows rendered by the 'figure' table, None for all of them
+SORT_ORDER_CACHE_SIZE = 512  # cached (neighbourhood, month, sort column) orders per city, 0 to use partial selection only
+EXPORT_ROUTE = '/export/'  # the table's rows as CSV or Parquet, e.g. /export/listings.csv?city=Madrid%2C%20Spain&month=all
+EXPORT_CHUNK_ROWS = 50000  # rows copied per chunk (and per Parquet row group) while a download streams
+
+# Forecasts of each neighbourhood's monthly mean price and rating, fitted when a city loads (or offline
+# with python -m src.forecast) and stored next to the listings cache. Without them the last two months
+# of the data are shown as the forecast.
+FORECAST_ENABLED = True
+FORECAST_HORIZON = 2  # months forecast after the last month of the data
+FORECAST_LEVEL = 0.8  # coverage of the prediction intervals
+FORECAST_MIN_POINTS = 4  # months of data a neighbourhood needs to be forecast
+
+# Listing search over name, host and category, from an index built when a city loads
+SEARCH_ENABLED = True
+SEARCH_RESULTS = 10  # listings returned per query
+SEARCH_MIN_PREFIX = 2  # shorter query words must match a whole word
+
+# Cross-city comparison panel, rolled up from every loaded city's (neighbourhood, month) stats
+COMPARISON_CITIES = PRELOAD_CITIES  # selected when the page opens; other cities are loaded when picked
+COMPARISON_PRICE_BINS = [0, 50, 75, 100, 150, 200, 300, 500, 1000]  # lower edges of the price distribution bands
+
+LISTINGS_COLUMNS = [
+    'date', 'month', 'price', 'neighbourhood_cleansed', 'review_scores_rating', 'name', 'host_total_listings_count',
+    'number_of_reviews', 'id', 'host_name', 'host_id', 'reviews_per_month', 'top_amenities_with_percentages',
+    'Positivity_Score(1to5)', 'category'
+]
+
+# Applied when the CSV is parsed; int8/int32 columns holding missing values fall back to float32.
+# Listing ids are 18-digit numbers, so ids stay 64-bit (nullable Int64 when some are missing).
+LISTINGS_DTYPES = {
+    'month': 'int8',
+    'price': 'float32',
+    'neighbourhood_cleansed': 'category',
+    'review_scores_rating': 'float32',
+    'name': 'category',
+    'host_total_listings_count': 'float32',
+    'number_of_reviews': 'int32',
+    'id': 'int64',
+    'host_name': 'category',
+    'host_id': 'int64',
+    'reviews_per_month': 'float32',
+    'top_amenities_with_percentages': 'category',
+    'Positivity_Score(1to5)': 'float32',
+    'category': 'category'
+}
+
 CITY_PATHS = {
     'Madrid, Spain': {
         'listings': os.path.join(DATASET_DIR, 'madrid_final_data.csv'),
@@ -0,0 +1,14 @@
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8050')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.environ.get('GUNICORN_THREADS', '2'))
+# Importing the app is cheap, the master does it once and workers share the imported modules
+preload_app = True
+timeout = 120
+
+def post_worker_init(worker):
+    # Load the data in the background so the worker serves requests (and /ready answers 503) meanwhile
+    from src.data_loader import initialise_data
+    initialise_data(background=True)
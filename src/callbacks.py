@@ -1,25 +1,19 @@
-from dash.dependencies import Input, Output, State
-from dash import html
-import pandas as pd
-from src.utils import update_map, get_unique_dates, generate_table, get_sort_options, get_column_options, get_neighborhood_options, parse_top_amenities
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash import html, ctx, no_update
+from src.utils import update_map, create_series_figure, create_comparison_figure, generate_table, to_display_values
 import plotly.graph_objs as go
-from src.data_loader import listings_data, neighborhood_stats, neighborhoods_geojson
+from src.data_loader import registry, listings_data, listings_index, neighborhood_stats, neighborhoods_geojson, city_metadata, date_marks, forecast_dates, price_bin_columns, price_bin_labels
+from src.figure_cache import create_figure_cache
+from src.metrics import phase
 import config
 
-unique_dates = get_unique_dates(config.CITY_PATHS)
-date_marks = {i: date.strftime('%Y-%m') for i, date in enumerate(sorted(unique_dates))}
+map_cache = create_figure_cache(config.MAP_CACHE_SIZE, directory=config.MAP_CACHE_DIR, redis_url=config.MAP_CACHE_REDIS_URL)
+registry.add_listener(map_cache.invalidate)
 
 def register_callbacks(app):
-    @app.callback(
-        Output('table-container', 'children'),
-        [Input('city-dropdown', 'value'), Input('month-slider', 'value'), Input('sort-dropdown', 'value'), Input('columns-dropdown', 'value'), Input('order-asc', 'n_clicks'), Input('order-desc', 'n_clicks'), Input('neighborhood-dropdown', 'value')]
-    )
-    def update_table(selected_city, selected_date_index, sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood):
-        if selected_city not in listings_data:
-            return html.Div("Invalid city selected")
-        
+    def select_table_rows(selected_city, selected_date_index, sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood, page=None):
         selected_month = int(date_marks[selected_date_index].split('-')[1])
-        listings_filtered = listings_data[selected_city][(listings_data[selected_city]['month'] == selected_month) & (listings_data[selected_city]['neighbourhood_cleansed'] == selected_neighborhood)]
+        index = listings_index[selected_city]
 
         if sort_by is None:
             sort_by = 'review_scores_rating'
@@ -32,245 +26,254 @@ def register_callbacks(app):
 
         order = 'asc' if n_clicks_asc > n_clicks_desc else 'desc'
 
-        table_listings = listings_filtered.sort_values(by=sort_by, ascending=(order == 'asc'))
-        table_listings = table_listings[columns_to_display]
-        return generate_table(table_listings)
-
-    @app.callback(
-        Output('sort-dropdown', 'options'),
-        [Input('city-dropdown', 'value')]
+        # Only the top of the sorted partition is materialised: one page, or TABLE_TOP_K rows for the figure table
+        total_rows = index.size(selected_neighborhood, selected_month)
+        if page is None:
+            start, stop = 0, config.TABLE_TOP_K
+        else:
+            page = min(page, max(0, total_rows - 1) // config.TABLE_PAGE_SIZE)
+            start, stop = page * config.TABLE_PAGE_SIZE, (page + 1) * config.TABLE_PAGE_SIZE
+
+        table_listings = index.sorted_rows(selected_neighborhood, selected_month, sort_by, order == 'asc', columns_to_display, start, stop)
+        return to_display_values(table_listings), total_rows, page
+
+    table_inputs = [Input('city-dropdown', 'value'), Input('month-slider', 'value'), Input('sort-dropdown', 'value'), Input('columns-dropdown', 'value'), Input('order-asc', 'n_clicks'), Input('order-desc', 'n_clicks'), Input('neighborhood-dropdown', 'value')]
+    table_controls = table_inputs[2:]
+    # City and month changes redraw the table in update_city, the table's own callbacks only read them
+    table_location = [State('city-dropdown', 'value'), State('month-slider', 'value')]
+
+    if config.TABLE_MODE == 'paged':
+        def table_outputs(allow_duplicate=False):
+            return [Output('listings-table', 'data', allow_duplicate=allow_duplicate),
+                    Output('listings-table', 'columns', allow_duplicate=allow_duplicate),
+                    Output('listings-table', 'page_count', allow_duplicate=allow_duplicate),
+                    Output('listings-table', 'page_current', allow_duplicate=allow_duplicate),
+                    Output('table-row-count', 'children', allow_duplicate=allow_duplicate)]
+
+        def render_table(selected_city, selected_date_index, sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood, page_current=0):
+            if selected_city not in listings_data:
+                return [[], [], 1, 0, "Invalid city selected"]
+
+            with phase('filter'):
+                page, total_rows, page_current = select_table_rows(selected_city, selected_date_index, sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood, page_current)
+            page_count = max(1, -(-total_rows // config.TABLE_PAGE_SIZE))
+
+            columns = [{'name': config.COLUMN_DISPLAY_NAMES.get(col, col), 'id': col} for col in page.columns]
+            with phase('serialise'):
+                records = page.to_dict('records')
+            return [records, columns, page_count, page_current, f"{total_rows} listings"]
+
+        @app.callback(
+            table_outputs(allow_duplicate=True),
+            table_controls + [Input('listings-table', 'page_current')] + table_location,
+            prevent_initial_call=True
+        )
+        def update_table(sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood, page_current, selected_city, selected_date_index):
+            # Any change other than paging starts again from the first page
+            if ctx.triggered_id != 'listings-table' or page_current is None:
+                page_current = 0
+            return render_table(selected_city, selected_date_index, sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood, page_current)
+    else:
+        def table_outputs(allow_duplicate=False):
+            return [Output('table-container', 'children', allow_duplicate=allow_duplicate)]
+
+        def render_table(selected_city, selected_date_index, sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood):
+            if selected_city not in listings_data:
+                return [html.Div("Invalid city selected")]
+
+            with phase('filter'):
+                table_listings, _, _ = select_table_rows(selected_city, selected_date_index, sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood)
+            with phase('figure'):
+                return [generate_table(table_listings)]
+
+        @app.callback(
+            table_outputs(allow_duplicate=True),
+            table_controls + table_location,
+            prevent_initial_call=True
+        )
+        def update_table(sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood, selected_city, selected_date_index):
+            return render_table(selected_city, selected_date_index, sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood)
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='dashboard', function_name='export_links'),
+        Output('export-csv', 'href'),
+        Output('export-parquet', 'href'),
+        table_inputs + [Input('export-scope', 'value')],
+        [State('month-slider', 'marks'), State('export-route', 'data')]
     )
-    def update_sort_options(selected_city):
-        return get_sort_options(listings_data, selected_city)
 
-    @app.callback(
-        Output('columns-dropdown', 'options'),
-        [Input('city-dropdown', 'value')]
-    )
-    def update_column_options(selected_city):
-        if selected_city in listings_data:
-            available_columns = listings_data[selected_city].columns
-            additional_columns = [col for col in config.ADDITIONAL_COLUMNS_LIST if col in available_columns]
-            return [{'label': config.COLUMN_DISPLAY_NAMES.get(col, col), 'value': col} for col in additional_columns]
-        return []
+    search_outputs = [Output('search-results', 'data'), Output('search-results', 'columns')] if config.SEARCH_ENABLED else []
+    search_state = [State('search-input', 'value'), State('search-rank', 'value')] if config.SEARCH_ENABLED else []
 
     @app.callback(
-        Output('map-container', 'children'),
+        [Output('sort-dropdown', 'options'),
+         Output('columns-dropdown', 'options'),
+         Output('neighborhood-dropdown', 'options'),
+         Output('map-container', 'children')]
+        + table_outputs()
+        + [Output('scatter-series', 'data'), Output('Amenities', 'figure')]
+        + search_outputs,
         [Input('city-dropdown', 'value'), Input('month-slider', 'value')]
+        + [State(item.component_id, item.component_property) for item in table_controls]
+        + search_state
     )
-    def update_map_callback(selected_city, selected_date_index):
+    def update_city(selected_city, selected_date_index, sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood, *search_query):
+        # A city switch or a month change is one request: the map and the table, plus for a new city the dropdown
+        # options (from metadata built when the city loaded), the neighbourhood charts and the search results.
+        # The callbacks of those components only read the city and month as State.
+        map_children = render_map(selected_city, selected_date_index)
+        table = render_table(selected_city, selected_date_index, sort_by, selected_columns, n_clicks_asc, n_clicks_desc, selected_neighborhood)
+        if ctx.triggered_id == 'month-slider' and 'city-dropdown.value' not in ctx.triggered_prop_ids:
+            return [no_update] * 3 + [map_children] + table + [no_update] * (2 + len(search_outputs))
+
+        metadata = city_metadata.get(selected_city)
+        options = [[], [], []] if metadata is None else [metadata['sort_options'], metadata['column_options'], metadata['neighbourhood_options']]
+        # The charts are only drawn when the selected neighbourhood also exists in the new city
+        if metadata is not None and selected_neighborhood in metadata['neighbourhoods']:
+            charts = [scatter_series(selected_city, selected_neighborhood), amenities_figure(selected_city, selected_neighborhood)]
+        else:
+            charts = [None, go.Figure()]
+        search = search_results(selected_city, *search_query) if config.SEARCH_ENABLED else []
+        return options + [map_children] + table + charts + search
+
+    def render_map(selected_city, selected_date_index):
         # Extract the month part, remove any non-numeric characters
         selected_month_str = date_marks[selected_date_index].split('-')[1]
         selected_month = int(''.join(filter(str.isdigit, selected_month_str)))
 
         # Determine if the selected month is a forecasted month
-        is_forecasted = selected_month > 6 and '2024' in date_marks[selected_date_index]
-        
-        return update_map(selected_city, selected_month, is_forecasted, config.CITY_PATHS, neighborhoods_geojson, neighborhood_stats)
+        stats = neighborhood_stats
+        if forecast_dates:
+            is_forecasted = date_marks[selected_date_index] in forecast_dates
+            city_data = registry.get(selected_city) if is_forecasted else None
+            if city_data is not None:
+                # Forecast months are mapped from the precomputed forecasts, shaped like the stats
+                stats = {selected_city: city_data.forecast_stats(date_marks[selected_date_index])}
+        else:
+            is_forecasted = selected_month > 6 and '2024' in date_marks[selected_date_index]
 
-    @app.callback(
+        return update_map(selected_city, selected_month, is_forecasted, config.CITY_PATHS, neighborhoods_geojson, stats,
+                          figure_cache=map_cache, data_version=registry.version(selected_city))
+
+    # Presentational callbacks run in the browser (assets/clientside.js), they need no data
+    app.clientside_callback(
+        ClientsideFunction(namespace='dashboard', function_name='copy_value'),
         Output('neighborhood-dropdown', 'value'),
         Input('clicked-neighborhood', 'data'),
     )
-    def update_neighborhood_dropdown(clicked_neighborhood):
-        return clicked_neighborhood
 
-    @app.callback(
+    app.clientside_callback(
+        ClientsideFunction(namespace='dashboard', function_name='toggle_modal'),
         Output("modal", "is_open"),
         Output('clicked-neighborhood', 'data'),
         [Input('map', 'clickData')],
         [State("modal", "is_open")],
     )
-    def toggle_modal(clickData, is_open):
-        if clickData:
-            neighborhood = clickData['points'][0]['location']
-            return not is_open, neighborhood
-        return is_open, None
+
+    def scatter_series(selected_city, selected_neighborhood):
+        city_data = registry.get(selected_city)
+        if city_data is None:
+            return None
+
+        # Both metrics come from the per-neighbourhood series precomputed at load time
+        with phase('filter'):
+            listings_aggregated = city_data.timeseries(selected_neighborhood)
+            forecast = city_data.forecast(selected_neighborhood)
+
+        # Both figures are sent at once, the price/rating buttons switch between them in the browser.
+        # Their template is the same and most of the payload, so it is sent only once.
+        with phase('figure'):
+            price = create_series_figure(listings_aggregated, 'mean_price', 'Price', selected_neighborhood, 'green', 'orange', forecast).to_dict()
+            rating = create_series_figure(listings_aggregated, 'mean_rating', 'Rating', selected_neighborhood, 'blue', 'red', forecast).to_dict()
+            template = price['layout'].pop('template')
+            rating['layout'].pop('template')
+        return {'price': price, 'rating': rating, 'template': template}
 
     @app.callback(
+        Output('scatter-series', 'data', allow_duplicate=True),
+        [Input('neighborhood-dropdown', 'value'), State('city-dropdown', 'value')],
+        prevent_initial_call=True
+    )
+    def update_scatter_series(selected_neighborhood, selected_city):
+        return scatter_series(selected_city, selected_neighborhood)
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='dashboard', function_name='show_series'),
         Output('scatter-plot', 'figure'),
         Output('plot-title', 'children'),
-        [Input('city-dropdown', 'value'), Input('neighborhood-dropdown', 'value'), Input('price-over-time', 'n_clicks'), Input('rating-over-time', 'n_clicks')]
+        [Input('scatter-series', 'data'), Input('price-over-time', 'n_clicks'), Input('rating-over-time', 'n_clicks')]
     )
-    def update_scatter_plot(selected_city, selected_neighborhood, n_clicks_price, n_clicks_rating):
-        if selected_city not in listings_data:
-            return go.Figure(), ""
-
-        listings_filtered = listings_data[selected_city][listings_data[selected_city]['neighbourhood_cleansed'] == selected_neighborhood]
-
-        if n_clicks_rating > n_clicks_price:
-            listings_aggregated = listings_filtered.groupby('date').agg(
-                mean_rating=('review_scores_rating', 'mean')
-            ).reset_index()
-
-            # Identify the last two months
-            forecast_start_index = -2  # Start of forecasted months
-
-            fig = go.Figure()
-
-            # Add trace for all data points including the connection to the forecasted months
-            fig.add_trace(go.Scatter(
-                x=listings_aggregated['date'],
-                y=listings_aggregated['mean_rating'],
-                mode='lines',  # Connect all points with a line
-                name='Mean Rating',
-                line=dict(color='blue'),  # Original color
-                marker=dict(color='blue', size=8)
-            ))
-
-            # Add a trace for the forecasted points with a different color
-            fig.add_trace(go.Scatter(
-                x=listings_aggregated['date'][forecast_start_index:],
-                y=listings_aggregated['mean_rating'][forecast_start_index:],
-                mode='markers+lines',
-                name='Forecasted Rating',
-                line=dict(color='red'),  # Forecasted color
-                marker=dict(color='red', size=8)
-            ))
 
-            fig.update_layout(
-                title=f'Rating Over Time in {selected_neighborhood}',
-                xaxis_title='Date',
-                yaxis_title='Rating',
-                xaxis=dict(
-                    showgrid=True,
-                    zeroline=False,
-                    tickmode='array',
-                    tickvals=listings_aggregated['date'],
-                    ticktext=[date.strftime('%Y-%m') for date in listings_aggregated['date']],
-                    gridcolor='rgba(0,0,0,0.3)',
-                    gridwidth=1,
-                ),
-                yaxis=dict(
-                    showgrid=True,
-                    zeroline=False,
-                    gridcolor='rgba(0,0,0,0.3)',
-                    gridwidth=1,
-                ),
-                template='plotly',
-                margin=dict(l=40, r=40, t=40, b=40),
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                xaxis_showspikes=False,
-                yaxis_showspikes=False,
-                xaxis_showline=True,
-                yaxis_showline=True,
-                xaxis_linecolor='black',
-                yaxis_linecolor='black',
-                xaxis_linewidth=2,
-                yaxis_linewidth=2,
-            )
-
-            return fig, "Rating Over Time"
-
-        else:
-            listings_aggregated = listings_filtered.groupby('date').agg(
-                mean_price=('price', 'mean')
-            ).reset_index()
-
-            # Identify the last two months
-            forecast_start_index = -2  # Start of forecasted months
-
-            fig = go.Figure()
-
-            # Add trace for all data points including the connection to the forecasted months
-            fig.add_trace(go.Scatter(
-                x=listings_aggregated['date'],
-                y=listings_aggregated['mean_price'],
-                mode='lines',  # Connect all points with a line
-                name='Mean Price',
-                line=dict(color='green'),  # Original color
-                marker=dict(color='green', size=8)
-            ))
-
-            # Add a trace for the forecasted points with a different color
-            fig.add_trace(go.Scatter(
-                x=listings_aggregated['date'][forecast_start_index:],
-                y=listings_aggregated['mean_price'][forecast_start_index:],
-                mode='markers+lines',
-                name='Forecasted Price',
-                line=dict(color='orange'),  # Forecasted color
-                marker=dict(color='orange', size=8)
-            ))
-
-            fig.update_layout(
-                title=f'Price Over Time in {selected_neighborhood}',
-                xaxis_title='Date',
-                yaxis_title='Price',
-                xaxis=dict(
-                    showgrid=True,
-                    zeroline=False,
-                    tickmode='array',
-                    tickvals=listings_aggregated['date'],
-                    ticktext=[date.strftime('%Y-%m') for date in listings_aggregated['date']],
-                    gridcolor='rgba(0,0,0,0.3)',
-                    gridwidth=1,
-                ),
-                yaxis=dict(
-                    showgrid=True,
-                    zeroline=False,
-                    gridcolor='rgba(0,0,0,0.3)',
-                    gridwidth=1,
-                ),
-                template='plotly',
-                margin=dict(l=40, r=40, t=40, b=40),
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                xaxis_showspikes=False,
-                yaxis_showspikes=False,
-                xaxis_showline=True,
-                yaxis_showline=True,
-                xaxis_linecolor='black',
-                yaxis_linecolor='black',
-                xaxis_linewidth=2,
-                yaxis_linewidth=2,
-            )
-
-            return fig, "Price Over Time"
-
-    @app.callback(
-        Output('Amenities', 'figure'),
-        [Input('city-dropdown', 'value'),
-         Input('neighborhood-dropdown', 'value')]
-    )
-    def top_10_amenities_graph(selected_city, selected_neighborhood):
+    def amenities_figure(selected_city, selected_neighborhood):
         # Check if selected_city or selected_neighborhood is None
         if not selected_city or not selected_neighborhood:
             return go.Figure()  # Return an empty figure if no city or neighborhood is selected
         
-        # Filter data for the selected neighborhood and city
-        listings_filtered = listings_data.get(selected_city, pd.DataFrame()).loc[
-            listings_data[selected_city]['neighbourhood_cleansed'] == selected_neighborhood
-        ]
-        
-        if listings_filtered.empty:
-            return go.Figure()  # Return an empty figure if no data
-        
-        # Select the first row
-        first_neighbourhood = listings_filtered.iloc[0]
+        city_data = registry.get(selected_city)
+        if city_data is None:
+            return go.Figure()
 
-        # Parse amenities
-        parsed_amenities = parse_top_amenities(first_neighbourhood['top_amenities_with_percentages'])
+        # Amenities were parsed per neighbourhood when the city was loaded
+        with phase('filter'):
+            parsed_amenities = city_data.amenities(selected_neighborhood)
 
-        if not parsed_amenities:
-            return go.Figure()  # Return an empty figure if parsing fails
+        if parsed_amenities.empty:
+            return go.Figure()  # Return an empty figure if no data or parsing failed
         
         # Prepare data for the bar chart
-        amenities_names = [item[0] for item in parsed_amenities]
-        amenities_percentages = [item[2] for item in parsed_amenities]
+        amenities_names = parsed_amenities['amenity']
+        amenities_percentages = parsed_amenities['percentage']
 
         # Create the bar chart using Plotly
-        fig = go.Figure(data=[go.Bar(x=amenities_names, y=amenities_percentages, marker_color='skyblue')])
-        fig.update_layout(
-            xaxis_title='Top 10 Amenities',
-            yaxis_title='Presence in Listings(%)',
-            xaxis_tickangle=-45
-        )
+        with phase('figure'):
+            fig = go.Figure(data=[go.Bar(x=amenities_names, y=amenities_percentages, marker_color='skyblue')])
+            fig.update_layout(
+                xaxis_title='Top 10 Amenities',
+                yaxis_title='Presence in Listings(%)',
+                xaxis_tickangle=-45
+            )
         return fig
 
     @app.callback(
-        Output('neighborhood-dropdown', 'options'),
-        [Input('city-dropdown', 'value')]
+        Output('Amenities', 'figure', allow_duplicate=True),
+        [Input('neighborhood-dropdown', 'value'), State('city-dropdown', 'value')],
+        prevent_initial_call=True
     )
-    def update_neighborhood_options(selected_city):
-        return get_neighborhood_options(listings_data, selected_city)
\ No newline at end of file
+    def top_10_amenities_graph(selected_neighborhood, selected_city):
+        return amenities_figure(selected_city, selected_neighborhood)
+
+    @app.callback(
+        Output('comparison-graph', 'figure'),
+        [Input('comparison-cities', 'value')]
+    )
+    def update_comparison(selected_cities):
+        # Every selected city comes out of the precomputed roll-up in one lookup, no listings are scanned
+        with phase('filter'):
+            summary = registry.comparison(selected_cities or [])
+        with phase('figure'):
+            return create_comparison_figure(summary, price_bin_columns(), price_bin_labels())
+
+    def search_results(selected_city, query, rank_by):
+        if not query or not query.strip():
+            return [[], []]
+        city_data = registry.get(selected_city)
+        if city_data is None:
+            return [[], []]
+
+        # Answered from the city's inverted index, the listings are only read for the top rows
+        with phase('filter'):
+            results = city_data.search(query, rank_by)
+        columns = [{'name': config.COLUMN_DISPLAY_NAMES.get(col, col), 'id': col} for col in results.columns]
+        with phase('serialise'):
+            records = to_display_values(results).to_dict('records')
+        return [records, columns]
+
+    if config.SEARCH_ENABLED:
+        @app.callback(
+            Output('search-results', 'data', allow_duplicate=True),
+            Output('search-results', 'columns', allow_duplicate=True),
+            [Input('search-input', 'value'), Input('search-rank', 'value'), State('city-dropdown', 'value')],
+            prevent_initial_call=True
+        )
+        def search_listings(query, rank_by, selected_city):
+            return search_results(selected_city, query, rank_by)
@@ -1,51 +1,630 @@
-import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
 import config
+from src.forecast import load_forecasts, future_dates
+from src.geometry import load_geojson
+from src.listings_cache import feather, load_listings, build_cache, is_cached, read_derived, write_derived
+from src.metrics import cache_event, phase
+from src.partitions import PartitionIndex, is_partitioned, sort_for_partitions
+from src.search import SearchIndex
+from src.utils import get_unique_dates, get_date_marks, parse_amenities_column, get_sort_options, get_column_options, get_neighborhood_options
 
-def load_data(city_paths):
+class CityLoadError(Exception):
+    pass
+
+STATS_VERSION = 1
+TIMESERIES_COLUMNS = ['date', 'mean_price', 'mean_rating', 'count']
+AMENITY_COLUMNS = ['amenity', 'count', 'percentage']
+
+class CityData:
+    def __init__(self, neighborhoods_geojson, neighborhood_stats, listings_data, neighborhood_timeseries, neighborhood_amenities, geojson_bytes=0, version=None, forecasts=None):
+        self.version = version
+        self.neighborhoods_geojson = neighborhoods_geojson
+        self.neighborhood_stats = neighborhood_stats
+        self.listings_data = listings_data
+        self.listings_index = PartitionIndex(listings_data, order_cache_size=config.SORT_ORDER_CACHE_SIZE)
+        self.metadata = build_metadata(listings_data, self.listings_index)
+        self.search_index = SearchIndex(listings_data) if config.SEARCH_ENABLED else None
+        self.neighborhood_timeseries = neighborhood_timeseries
+        self.timeseries_by_neighborhood = {
+            neighborhood: group[TIMESERIES_COLUMNS].reset_index(drop=True)
+            for neighborhood, group in neighborhood_timeseries.groupby('neighbourhood_cleansed', sort=False, observed=True)
+        }
+        self.neighborhood_amenities = neighborhood_amenities
+        self.amenities_by_neighborhood = {
+            neighborhood: group[AMENITY_COLUMNS].reset_index(drop=True)
+            for neighborhood, group in neighborhood_amenities.groupby('neighbourhood_cleansed', sort=False, observed=True)
+        }
+        # None when forecasting is disabled, the charts then fall back to treating the last two dates as forecasts
+        self.forecasts = forecasts
+        self.forecasts_by_neighborhood = {} if forecasts is None else {
+            neighborhood: group.drop(columns='neighbourhood_cleansed').reset_index(drop=True)
+            for neighborhood, group in forecasts.groupby('neighbourhood_cleansed', sort=False, observed=True)
+        }
+        self.nbytes = (geojson_bytes + int(listings_data.memory_usage(deep=True).sum())
+                       + int(neighborhood_stats.memory_usage(deep=True).sum())
+                       + int(neighborhood_timeseries.memory_usage(deep=True).sum())
+                       + int(neighborhood_amenities.memory_usage(deep=True).sum())
+                       + (int(forecasts.memory_usage(deep=True).sum()) if forecasts is not None else 0)
+                       + (self.search_index.nbytes if self.search_index is not None else 0))
+
+    def memory_report(self):
+        columns = self.listings_data.memory_usage(deep=True, index=False)
+        return {
+            'rows': len(self.listings_data),
+            'total_bytes': self.nbytes,
+            'listings_bytes': int(columns.sum()),
+            'search_bytes': self.search_index.nbytes if self.search_index is not None else 0,
+            'columns': {col: int(size) for col, size in columns.items()},
+        }
+
+    def timeseries(self, neighborhood):
+        return self.timeseries_by_neighborhood.get(neighborhood, pd.DataFrame(columns=TIMESERIES_COLUMNS))
+
+    def amenities(self, neighborhood):
+        return self.amenities_by_neighborhood.get(neighborhood, pd.DataFrame(columns=AMENITY_COLUMNS))
+
+    def search(self, query, rank_by, limit=None):
+        if self.search_index is None:
+            return None
+        return self.search_index.search(query, rank_by, limit)
+
+    def forecast(self, neighborhood):
+        if self.forecasts is None:
+            return None
+        return self.forecasts_by_neighborhood.get(neighborhood, self.forecasts.iloc[:0])
+
+    def forecast_stats(self, month_label):
+        # One forecast month ('YYYY-MM') shaped like neighborhood_stats, for the map
+        if self.forecasts is None:
+            return None
+        rows = self.forecasts[self.forecasts['date'].dt.strftime('%Y-%m') == month_label]
+        return rows.rename(columns={'mean_price': 'avg_price', 'mean_rating': 'avg_ratings'})
+
+def build_metadata(listings, listings_index):
+    # What the city dropdown needs, built once so a city switch never scans the listings
+    neighborhoods = sorted(listings_index.neighbourhood_ranges)
+    dates = listings['date']
+    return {
+        'neighbourhoods': neighborhoods,
+        'columns': list(listings.columns),
+        'date_range': (dates.min().strftime('%Y-%m-%d'), dates.max().strftime('%Y-%m-%d')) if len(dates) else None,
+        'sort_options': get_sort_options(listings.columns),
+        'column_options': get_column_options(listings.columns),
+        'neighbourhood_options': get_neighborhood_options(neighborhoods),
+    }
+
+def build_timeseries(listings):
+    return listings.groupby(['neighbourhood_cleansed', 'date'], observed=True).agg(
+        mean_price=('price', 'mean'),
+        mean_rating=('review_scores_rating', 'mean'),
+        count=('price', 'size')
+    ).reset_index()
+
+def build_amenities(city, listings):
+    # The amenities string repeats on every row of a neighbourhood, its first row is parsed once
+    first_rows = listings.drop_duplicates('neighbourhood_cleansed')
+    amenities, malformed = parse_amenities_column(
+        first_rows.set_index('neighbourhood_cleansed')['top_amenities_with_percentages'])
+    if malformed:
+        print(f"Skipped {malformed} malformed amenity entries for {city}")
+    return amenities
+
+def source_version(paths):
+    # Identical in every worker process, so it can key caches shared between them
+    return '-'.join(str(os.stat(path).st_mtime_ns) if os.path.exists(path) else '0'
+                    for path in (paths['listings'], paths['geojson']))
+
+def read_city(city, paths):
+    try:
+        neighborhoods_geojson = load_geojson(paths['geojson'])
+    except FileNotFoundError:
+        raise CityLoadError(f"GeoJSON file for {city} not found at {paths['geojson']}")
+    return neighborhoods_geojson, read_city_listings(city, paths)
+
+def read_city_listings(city, paths):
+    try:
+        listings = load_listings(paths['listings'])
+    except FileNotFoundError:
+        raise CityLoadError(f"Listings CSV file for {city} not found at {paths['listings']}")
+    except ValueError as e:
+        # e.g. a Git LFS pointer checked out instead of the CSV itself
+        raise CityLoadError(f"Listings CSV file for {city} at {paths['listings']} could not be parsed: {e}")
+
+    if not is_partitioned(listings):
+        listings = sort_for_partitions(listings)
+    return listings
+
+def build_stats(city, listings):
+    agg_columns = {
+        'price': 'mean',
+        'review_scores_rating': 'mean',
+        'number_of_reviews': 'mean',
+        'name': 'count'
+    }
+
+    available_columns = [col for col in agg_columns.keys() if col in listings.columns]
+    if not available_columns:
+        raise CityLoadError(f"No columns to aggregate in listings for {city}")
+
+    grouped = listings.groupby(['neighbourhood_cleansed', 'month'], observed=True)
+    stats = grouped[available_columns].agg(agg_columns)
+    if 'price' in listings.columns and 'review_scores_rating' in listings.columns:
+        stats = stats.join(build_cube_columns(listings, grouped))
+    stats = stats.reset_index()
+    if 'price' in stats.columns:
+        stats = stats.rename(columns={'price': 'avg_price'})
+    if 'review_scores_rating' in stats.columns:
+        stats = stats.rename(columns={'review_scores_rating': 'avg_ratings'})
+    return stats
+
+def stats_params():
+    return {'version': STATS_VERSION, 'price_bins': config.COMPARISON_PRICE_BINS}
+
+def save_stats(paths, stats):
+    if config.CACHE_WRITE_ON_MISS:
+        try:
+            write_derived(paths['listings'], 'stats', stats, stats_params())
+        except OSError as e:
+            print(f"Could not write stats for {paths['listings']}: {e}")
+
+def load_stats(city, paths, listings=None):
+    # Persisted next to the listings cache, so the comparison reads a city's stats without building the city
+    stats = read_derived(paths['listings'], 'stats', stats_params())
+    if stats is not None:
+        return stats
+    if listings is None:
+        listings = read_city_listings(city, paths)
+    stats = build_stats(city, listings)
+    save_stats(paths, stats)
+    return stats
+
+def build_cube_columns(listings, grouped):
+    # Sums, counts and a price histogram add up across neighbourhoods, so city-wide figures
+    # are rolled up from the stats without going back to the listings
+    totals = grouped.agg(
+        listings=('month', 'size'),
+        price_sum=('price', 'sum'),
+        price_count=('price', 'count'),
+        rating_sum=('review_scores_rating', 'sum'),
+        rating_count=('review_scores_rating', 'count'),
+    )
+    edges = np.asarray(config.COMPARISON_PRICE_BINS, dtype='float64')
+    prices = listings['price'].to_numpy(dtype='float64')
+    bins = np.where(np.isnan(prices), -1, np.searchsorted(edges, prices, side='right') - 1)
+    # Rows without a price fall in bin -1, which the reindex drops
+    histogram = listings.groupby([listings['neighbourhood_cleansed'], listings['month'], pd.Series(bins, index=listings.index)],
+                                 observed=True).size().unstack(fill_value=0)
+    histogram = histogram.reindex(columns=range(len(edges)), fill_value=0)
+    histogram.columns = price_bin_columns()
+    return totals.join(histogram)
+
+def price_bin_columns():
+    return [f'price_bin_{i}' for i in range(len(config.COMPARISON_PRICE_BINS))]
+
+def price_bin_labels():
+    edges = config.COMPARISON_PRICE_BINS
+    return [f'{low:g}-{high:g}' for low, high in zip(edges, edges[1:])] + [f'{edges[-1]:g}+']
+
+def build_comparison(stats_by_city):
+    # The (city, neighbourhood, month) cube and its (city, month) roll-up, from the stats of each city
+    cube = pd.concat({city: stats.astype({'neighbourhood_cleansed': str}) for city, stats in stats_by_city.items()}, names=['city'])
+    cube = cube.reset_index(level=1, drop=True).set_index(['neighbourhood_cleansed', 'month'], append=True).sort_index()
+    summary = cube[['listings', 'price_sum', 'price_count', 'rating_sum', 'rating_count'] + price_bin_columns()].groupby(level=['city', 'month']).sum()
+    summary['avg_price'] = summary['price_sum'] / summary['price_count'].where(summary['price_count'] > 0)
+    summary['avg_rating'] = summary['rating_sum'] / summary['rating_count'].where(summary['rating_count'] > 0)
+    return cube, summary
+
+def build_city(city, paths, neighborhoods_geojson, listings, stats=None, timeseries=None):
+    if stats is None:
+        stats = load_stats(city, paths, listings)
+    else:
+        save_stats(paths, stats)
+    if timeseries is None:
+        timeseries = build_timeseries(listings)
+    amenities = build_amenities(city, listings)
+    del listings['top_amenities_with_percentages']
+    forecasts = load_forecasts(paths['listings'], timeseries)
+
+    return CityData(neighborhoods_geojson, stats, listings, timeseries, amenities,
+                    geojson_bytes=os.path.getsize(paths['geojson']), version=source_version(paths), forecasts=forecasts)
+
+def load_city(city, paths):
+    neighborhoods_geojson, listings = read_city(city, paths)
+    return build_city(city, paths, neighborhoods_geojson, listings)
+
+def refresh_city(city, paths, previous):
+    # When the new file only appends dates, existing aggregates are kept and extended
+    neighborhoods_geojson, listings = read_city(city, paths)
+    old_counts = previous.listings_data['date'].value_counts()
+    new_counts = listings['date'].value_counts()
+    new_dates = new_counts.index.difference(old_counts.index)
+    if len(new_dates) == 0 or not new_counts.reindex(old_counts.index).equals(old_counts):
+        return build_city(city, paths, neighborhoods_geojson, listings)
+
+    new_rows = listings[listings['date'].isin(new_dates)]
+    months = new_rows['month'].unique()
+    old_stats = previous.neighborhood_stats
+    stats = pd.concat([old_stats[~old_stats['month'].isin(months)],
+                       build_stats(city, listings[listings['month'].isin(months)])])
+    timeseries = pd.concat([previous.neighborhood_timeseries, build_timeseries(new_rows)])
+
+    # Old and new frames carry different category sets, re-derive them from the combined values
+    stats = stats.astype({'neighbourhood_cleansed': 'category'}).sort_values(['neighbourhood_cleansed', 'month'], ignore_index=True)
+    timeseries = timeseries.astype({'neighbourhood_cleansed': 'category'}).sort_values(['neighbourhood_cleansed', 'date'], ignore_index=True)
+    print(f"Appended {len(new_dates)} new dates ({len(new_rows)} listings) to {city}")
+    return build_city(city, paths, neighborhoods_geojson, listings, stats=stats, timeseries=timeseries)
+
+def build_error(city, error):
+    # Anything else going wrong while building a city fails that city only, not the callback or the startup
+    return f"Could not build {city}: {type(error).__name__}: {error}"
+
+def load_city_result(city, paths):
+    try:
+        return city, load_city(city, paths), None
+    except CityLoadError as e:
+        return city, None, str(e)
+    except Exception as e:
+        return city, None, build_error(city, e)
+
+def prepare_city(city, paths):
+    # Runs in a forked worker: parses the CSV into the listings cache and persists the stats and forecasts.
+    # Only the outcome goes back, the parent maps the files instead of unpickling a copy of the city.
+    try:
+        listings = read_city_listings(city, paths)
+        load_stats(city, paths, listings)
+        load_forecasts(paths['listings'], build_timeseries(listings))
+    except CityLoadError as e:
+        return city, str(e)
+    except Exception as e:
+        return city, build_error(city, e)
+    return city, None
+
+def prepare_cities(city_paths, workers=None):
+    # CSVs without a fresh cache are parsed in parallel; returns the cities that failed with their errors.
+    # Under SHARED_DATASET the caches were built up front, and without a writable cache there is nothing to hand over.
+    stale = {city: paths for city, paths in city_paths.items() if not is_cached(paths['listings'])}
+    if workers is None:
+        workers = min(len(stale), os.cpu_count() or 1)
+    if (config.SHARED_DATASET or feather is None or not config.CACHE_WRITE_ON_MISS or workers < 2 or len(stale) < 2
+            or 'fork' not in multiprocessing.get_all_start_methods()):
+        return {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            results = list(pool.map(prepare_city, stale.keys(), stale.values()))
+    except (BrokenProcessPool, OSError) as e:
+        print(f"Parallel loading failed ({e}), loading cities one by one")
+        return {}
+    return {city: error for city, error in results if error is not None}
+
+def load_cities(city_paths, workers=None):
+    # Every city is built in-process, from the cache files prepare_cities wrote where it could
+    errors = prepare_cities(city_paths, workers)
+    results = [load_city_result(city, paths) for city, paths in city_paths.items() if city not in errors]
+
+    loaded = {city: data for city, data, _ in results if data is not None}
+    errors.update({city: error for city, _, error in results if error is not None})
+    return loaded, errors
+
+def load_data(city_paths, workers=None):
     neighborhoods_geojson = {}
     neighborhood_stats = {}
     listings_data = {}
 
-    for city, paths in city_paths.items():
-        try:
-            with open(paths['geojson'], 'r') as file:
-                neighborhoods_geojson[city] = json.load(file)
-        except FileNotFoundError:
-            print(f"GeoJSON file for {city} not found at {paths['geojson']}")
-            continue
+    loaded, errors = load_cities(city_paths, workers)
+    for city, data in loaded.items():
+        neighborhoods_geojson[city] = data.neighborhoods_geojson
+        neighborhood_stats[city] = data.neighborhood_stats
+        listings_data[city] = data.listings_data
 
-        try:
-            with open(paths['listings'], 'r', encoding='utf-8', errors='replace') as file:
-                listings = pd.read_csv(file, parse_dates=['date']).dropna(subset=['neighbourhood_cleansed', 'price'])
-        except FileNotFoundError:
-            print(f"Listings CSV file for {city} not found at {paths['listings']}")
-            continue
-
-        listings['month'] = listings['date'].dt.month
-
-        agg_columns = {
-            'price': 'mean',
-            'review_scores_rating': 'mean',
-            'number_of_reviews': 'mean',
-            'name': 'count'
-        }
+    return neighborhoods_geojson, neighborhood_stats, listings_data, errors
+
+class CityRegistry:
+    # Loads cities on first access and keeps the most recently used ones resident
+    def __init__(self, city_paths, max_cities=None, max_bytes=None):
+        self.city_paths = city_paths
+        self.max_cities = max_cities
+        self.max_bytes = max_bytes
+        self._resident = OrderedDict()
+        self.errors = {}
+        self._listeners = []
+        self._eviction_listeners = []
+        # Stats of every city loaded so far, kept after eviction for the cross-city comparison
+        self.stats_by_city = {}
+        self._comparison = None
+        self._lock = threading.Lock()
+        self._city_locks = {city: threading.Lock() for city in city_paths}
+
+    def get(self, city):
+        if city not in self.city_paths:
+            return None
+
+        with self._lock:
+            if city in self._resident:
+                self._resident.move_to_end(city)
+                return self._resident[city]
+            if city in self.errors:
+                return None
+
+        # Only one thread loads a given city, other cities keep being served meanwhile
+        with self._city_locks[city]:
+            with self._lock:
+                if city in self._resident:
+                    return self._resident[city]
+
+            cache_event('city', 'miss')
+            with phase('load'):
+                _, data, error = load_city_result(city, self.city_paths[city])
+
+            with self._lock:
+                if data is None:
+                    self.errors[city] = error
+                    print(error)
+                    return None
+                self._add(city, data)
+            return data
+
+    def _add(self, city, data):
+        self._resident[city] = data
+        self._set_stats(city, data.neighborhood_stats)
+        self._evict()
+        search = f", search index {data.search_index.nbytes / 1e6:.1f} MB" if data.search_index is not None else ""
+        print(f"Loaded {city}: {len(data.listings_data)} listings, {data.nbytes / 1e6:.1f} MB resident{search}")
+
+    def _evict(self):
+        # The newest city always stays, even when it alone exceeds the byte budget
+        while len(self._resident) > 1:
+            too_many = self.max_cities is not None and len(self._resident) > self.max_cities
+            too_big = self.max_bytes is not None and self.resident_bytes() > self.max_bytes
+            if not (too_many or too_big):
+                break
+            city, _ = self._resident.popitem(last=False)
+            print(f"Evicted {city} from memory")
+            for listener in self._eviction_listeners:
+                listener(city)
+
+    def _set_stats(self, city, stats):
+        if stats is None:
+            self.stats_by_city.pop(city, None)
+        else:
+            self.stats_by_city[city] = stats
+        self._comparison = None
+
+    def preload(self, cities, workers=None):
+        with self._lock:
+            pending = {city: self.city_paths[city] for city in cities
+                       if city in self.city_paths and city not in self._resident and city not in self.errors}
+        loaded, errors = load_cities(pending, workers)
+        with self._lock:
+            for city in pending:
+                if city in loaded:
+                    self._add(city, loaded[city])
+            self.errors.update(errors)
+        if errors:
+            print(f"Could not load {len(errors)} of {len(pending)} cities:")
+            for error in errors.values():
+                print(f"    {error}")
+
+    def add_listener(self, listener):
+        # Called with the city name after its data was refreshed
+        self._listeners.append(listener)
+
+    def add_eviction_listener(self, listener):
+        # Called with the city name after it was dropped from memory, under the registry lock
+        self._eviction_listeners.append(listener)
+
+    def refresh(self, city):
+        # The new data is built next to the old one and swapped in, readers never see a partial city
+        if city not in self.city_paths:
+            return False
+        with self._city_locks[city]:
+            with self._lock:
+                previous = self._resident.get(city)
+            try:
+                data = refresh_city(city, self.city_paths[city], previous) if previous is not None else None
+            except Exception as e:
+                data = None
+                error = str(e) if isinstance(e, CityLoadError) else build_error(city, e)
+                print(error)
+                with self._lock:
+                    self.errors[city] = error
+                    self._resident.pop(city, None)
+                    self._set_stats(city, None)
+            else:
+                # A city that is not resident simply loads the new files on its next access
+                with self._lock:
+                    self.errors.pop(city, None)
+                    if data is not None and city in self._resident:
+                        self._resident[city] = data
+                    # A city that is not resident gets new stats when it is loaded again
+                    self._set_stats(city, data.neighborhood_stats if data is not None else None)
+
+        for listener in self._listeners:
+            listener(city)
+        return data is not None
+
+    def version(self, city):
+        with self._lock:
+            data = self._resident.get(city)
+        if data is not None:
+            return data.version
+        return source_version(self.city_paths[city]) if city in self.city_paths else None
+
+    def load_stats(self, city):
+        # Only the stats, from their cache file or built from the listings without making the city resident,
+        # so comparing cities evicts none of the cities other sessions are using
+        with self._city_locks[city]:
+            with self._lock:
+                if city in self.stats_by_city or city in self.errors:
+                    return
+            try:
+                stats = load_stats(city, self.city_paths[city])
+            except Exception as e:
+                error = str(e) if isinstance(e, CityLoadError) else build_error(city, e)
+                print(error)
+                with self._lock:
+                    self.errors[city] = error
+                return
+            with self._lock:
+                if city not in self.stats_by_city:
+                    self._set_stats(city, stats)
+
+    def comparison(self, cities):
+        # (city, month) rows of the comparison roll-up, a single lookup however many cities are compared
+        cities = [city for city in cities if city in self.city_paths]
+        for city in cities:
+            if city not in self.stats_by_city:
+                self.load_stats(city)
+        with self._lock:
+            comparison = self._current_comparison()
+            cities = [city for city in cities if city in self.stats_by_city]
+        if comparison is None or not cities:
+            return None
+        _, summary = comparison
+        return summary.loc[cities]
+
+    def stats_cube(self):
+        # Every loaded city's stats indexed by (city, neighbourhood, month)
+        with self._lock:
+            comparison = self._current_comparison()
+        return comparison[0] if comparison is not None else None
+
+    def _current_comparison(self):
+        # Rebuilt under the lock after a city's stats changed, from a few rows per neighbourhood and month
+        if self._comparison is None and self.stats_by_city:
+            self._comparison = build_comparison(self.stats_by_city)
+        return self._comparison
+
+    def resident(self):
+        with self._lock:
+            return dict(self._resident)
+
+    def memory_report(self):
+        return {city: data.memory_report() for city, data in self.resident().items()}
+
+    def resident_bytes(self):
+        return sum(data.nbytes for data in self._resident.values())
+
+    def view(self, attribute):
+        return CityView(self, attribute)
+
+class CityView:
+    # Read-only dict-like access to one attribute of every city, e.g. listings_data[city]
+    def __init__(self, registry, attribute):
+        self.registry = registry
+        self.attribute = attribute
+
+    def __contains__(self, city):
+        return self.registry.get(city) is not None
+
+    def __getitem__(self, city):
+        data = self.registry.get(city)
+        if data is None:
+            raise KeyError(city)
+        return getattr(data, self.attribute)
+
+    def get(self, city, default=None):
+        data = self.registry.get(city)
+        return default if data is None else getattr(data, self.attribute)
+
+    def keys(self):
+        return self.registry.city_paths.keys()
+
+# Nothing is loaded at import; initialise_data() does that once the server is up
+registry = CityRegistry(config.CITY_PATHS, max_cities=config.MAX_RESIDENT_CITIES, max_bytes=config.MAX_RESIDENT_BYTES)
+
+neighborhoods_geojson = registry.view('neighborhoods_geojson')
+neighborhood_stats = registry.view('neighborhood_stats')
+listings_data = registry.view('listings_data')
+listings_index = registry.view('listings_index')
+city_metadata = registry.view('metadata')
+neighborhood_timeseries = registry.view('neighborhood_timeseries')
+neighborhood_amenities = registry.view('neighborhood_amenities')
+
+def refresh_dates(city=None):
+    # date_marks is updated in place so modules that imported it see the new dates
+    global unique_dates
+    resident_listings = {city: data.listings_data for city, data in registry.resident().items()}
+    observed_dates = get_unique_dates(config.CITY_PATHS, resident_listings)
+    forecast_months = future_dates(observed_dates)
+    unique_dates = observed_dates.append(pd.DatetimeIndex(forecast_months))
+    forecast_dates.clear()
+    forecast_dates.update(date.strftime('%Y-%m') for date in forecast_months)
+    date_marks.clear()
+    date_marks.update(get_date_marks(unique_dates))
 
-        available_columns = [col for col in agg_columns.keys() if col in listings.columns]
-        if not available_columns:
-            print(f"No columns to aggregate in listings for {city}")
-            continue
+unique_dates = None
+date_marks = {}
+forecast_dates = set()  # 'YYYY-MM' labels of the months after the data, empty without forecasts
+registry.add_listener(refresh_dates)
+data_ready = threading.Event()
+_initialise_lock = threading.Lock()
+_initialising = None  # pid of the process that started initialise_data
+_failures = 0
+_retry_after = 0.0  # time.monotonic() before which a failed initialisation is not retried
 
-        neighborhood_stats[city] = listings.groupby(['neighbourhood_cleansed', 'month'])[available_columns].agg(agg_columns).reset_index()
-        if 'price' in neighborhood_stats[city].columns:
-            neighborhood_stats[city] = neighborhood_stats[city].rename(columns={'price': 'avg_price'})
-        if 'review_scores_rating' in neighborhood_stats[city].columns:
-            neighborhood_stats[city] = neighborhood_stats[city].rename(columns={'review_scores_rating': 'avg_ratings'})
+def load_initial_data():
+    # A failure shows up under 'initialise' in /ready and lets a later initialise_data() call retry,
+    # after a wait that doubles with every failure in a row
+    global _initialising, _failures, _retry_after
+    try:
+        if config.SHARED_DATASET:
+            # Workers map the cache files, so they are built (once, under a file lock) before loading
+            try:
+                build_cache(config.CITY_PATHS)
+            except OSError as e:
+                # e.g. a read-only cache directory: every worker then parses the CSVs itself
+                print(f"Could not build the listings cache, loading from the CSVs: {e}")
+        registry.preload(config.PRELOAD_CITIES, workers=config.LOAD_WORKERS)
+        refresh_dates()
+    except Exception as e:
+        with _initialise_lock:
+            delay = min(config.INIT_RETRY_SECONDS * 2 ** _failures, config.INIT_RETRY_MAX_SECONDS)
+            _failures += 1
+            _retry_after = time.monotonic() + delay
+            registry.errors['initialise'] = str(e)
+            _initialising = None
+        print(f"Could not load the initial data, retrying in {delay:g} s at the earliest: {e}")
+        raise
+    with _initialise_lock:
+        _failures = 0
+        registry.errors.pop('initialise', None)
+    data_ready.set()
 
-        listings_data[city] = listings[['date', 'month', 'price', 'neighbourhood_cleansed', 'review_scores_rating', 'name', 'host_total_listings_count', 
-                                'number_of_reviews', 'id',  'host_name', 'host_id', 'reviews_per_month','top_amenities_with_percentages','Positivity_Score(1to5)','category'
-                                ]].copy()
+def initialise_data(background=False):
+    # Safe to call more than once; a forked worker whose parent already loaded the data keeps it
+    global _initialising
+    with _initialise_lock:
+        if data_ready.is_set() or _initialising == os.getpid() or time.monotonic() < _retry_after:
+            return
+        _initialising = os.getpid()
+    if background:
+        threading.Thread(target=load_initial_data, name='data-init', daemon=True).start()
+    else:
+        load_initial_data()
 
-    return neighborhoods_geojson, neighborhood_stats, listings_data
+def readiness():
+    return {
+        'ready': data_ready.is_set(),
+        'resident': list(registry.resident()),
+        'errors': dict(registry.errors),
+    }
 
-neighborhoods_geojson, neighborhood_stats, listings_data = load_data(config.CITY_PATHS)
\ No newline at end of file
+if __name__ == '__main__':
+    # Loads every city and prints where its memory goes
+    registry.max_cities = None
+    registry.max_bytes = None
+    registry.preload(config.CITY_PATHS, workers=config.LOAD_WORKERS)
+    for city, data in registry.resident().items():
+        report = data.memory_report()
+        print(f"{city}: {report['rows']} rows, {report['total_bytes'] / 1e6:.1f} MB total, {report['listings_bytes'] / 1e6:.1f} MB listings, "
+              f"{report['search_bytes'] / 1e6:.1f} MB search index")
+        for col, size in sorted(report['columns'].items(), key=lambda item: -item[1]):
+            print(f"    {col:<35} {str(data.listings_data[col].dtype):<15} {size / 1e6:8.2f} MB")
@@ -0,0 +1,108 @@
+import io
+from flask import Response, abort, request, stream_with_context
+import config
+from src.geojson_assets import city_slug
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Without pyarrow only CSV exports are served
+    pa = pq = None
+
+# Downloads of the rows behind the listings table. Rows are selected and sorted as the table does,
+# then copied out EXPORT_CHUNK_ROWS at a time while the response is sent, so only the sorted row
+# positions and one chunk are held in memory however large the selection is.
+
+CONTEXT_COLUMNS = ['neighbourhood_cleansed', 'date']
+
+class ParquetStream(io.RawIOBase):
+    # Write-only file that hands back what was written since the last drain. tell() keeps counting
+    # across drains, the Parquet footer records row group offsets from it.
+    def __init__(self):
+        self.buffers = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffers.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.buffers)
+        self.buffers = []
+        return data
+
+def csv_chunks(listings, positions, column_positions, chunk_rows):
+    # The first chunk carries the header, so an empty selection still downloads as a valid file
+    for offset in range(0, max(len(positions), 1), chunk_rows):
+        chunk = listings.iloc[positions[offset:offset + chunk_rows], column_positions]
+        yield chunk.to_csv(index=False, header=offset == 0)
+
+def parquet_chunks(listings, positions, column_positions, chunk_rows):
+    # One row group per chunk
+    schema = pa.Schema.from_pandas(listings.iloc[:0, column_positions], preserve_index=False)
+    stream = ParquetStream()
+    with pq.ParquetWriter(stream, schema) as writer:
+        for offset in range(0, len(positions), chunk_rows):
+            chunk = listings.iloc[positions[offset:offset + chunk_rows], column_positions]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield stream.drain()
+    yield stream.drain()
+
+EXPORT_FORMATS = {
+    'csv': (csv_chunks, 'text/csv'),
+    'parquet': (parquet_chunks, 'application/vnd.apache.parquet'),
+}
+
+def export_columns(listings, selected_columns, bulk):
+    # Same columns as the table; exports spanning several partitions also say where each row belongs
+    columns = config.DEFAULT_COLUMNS + [col for col in selected_columns if col in config.ADDITIONAL_COLUMNS_LIST]
+    if bulk:
+        columns = CONTEXT_COLUMNS + columns
+    return [col for col in dict.fromkeys(columns) if col in listings.columns]
+
+def register_export_route(server, registry):
+    @server.route(config.EXPORT_ROUTE + 'listings.<file_format>')
+    def export_listings(file_format):
+        # Query: city, month (1-12 or 'all'), neighbourhood (all when omitted), sort, order (asc/desc), columns (comma separated)
+        if file_format not in EXPORT_FORMATS or (file_format == 'parquet' and pq is None):
+            abort(404)
+        city = request.args.get('city')
+        if city not in config.CITY_PATHS:
+            abort(404)
+        city_data = registry.get(city)
+        if city_data is None:
+            abort(404)
+        listings = city_data.listings_data
+
+        month = request.args.get('month', 'all')
+        if month == 'all':
+            month = None
+        elif month.isdigit():
+            month = int(month)
+        else:
+            abort(400)
+        neighbourhood = request.args.get('neighbourhood') or None
+        sort_by = request.args.get('sort') or 'review_scores_rating'
+        if sort_by not in listings.columns:
+            abort(400)
+        ascending = request.args.get('order', 'desc') == 'asc'
+        selected_columns = [col for col in request.args.get('columns', '').split(',') if col]
+
+        columns = export_columns(listings, selected_columns, neighbourhood is None or month is None)
+        column_positions = [listings.columns.get_loc(col) for col in columns]
+        positions = city_data.listings_index.sorted_positions(neighbourhood, month, sort_by, ascending)
+
+        chunks, mimetype = EXPORT_FORMATS[file_format]
+        filename = '_'.join([city_slug(city), 'all' if month is None else f'{month:02d}',
+                             city_slug(neighbourhood) if neighbourhood else 'all']) + '.' + file_format
+        # The frame is held by the generator, a city evicted or refreshed meanwhile does not cut the download short
+        body = chunks(listings, positions, column_positions, config.EXPORT_CHUNK_ROWS)
+        return Response(stream_with_context(body), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from src.metrics import cache_event
+
+class DiskBackend:
+    # Shared between worker processes on one host through the filesystem
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        # Per thread as well as per process: two callbacks can render the same figure at once
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(value)
+        os.replace(temp_path, path)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+class RedisBackend:
+    # Works with any client exposing Redis-style get/set/scan_iter/delete
+    def __init__(self, client, prefix='airbnb_dashboard:figure:', ttl=None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+class FigureCache:
+    # In-process LRU of figure dicts, optionally backed by a store shared across workers
+    def __init__(self, maxsize=64, backend=None):
+        self.maxsize = maxsize
+        self.backend = backend
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(key):
+        return json.dumps(list(key), default=str)
+
+    def get_or_build(self, key, build):
+        key = self.make_key(key)
+        with self._lock:
+            if key in self._figures:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                cache_event('figure', 'hit')
+                return self._figures[key]
+
+        figure_json = self.backend.get(key) if self.backend is not None else None
+        if figure_json is not None:
+            with self._lock:
+                self.backend_hits += 1
+            cache_event('figure', 'shared_hit')
+        else:
+            cache_event('figure', 'miss')
+            figure_json = build()
+            with self._lock:
+                self.misses += 1
+            if self.backend is not None:
+                self.backend.set(key, figure_json)
+
+        figure = json.loads(figure_json)
+        with self._lock:
+            self._figures[key] = figure
+            while len(self._figures) > self.maxsize:
+                self._figures.popitem(last=False)
+        return figure
+
+    def invalidate(self, first_key_part):
+        # Drops in-process entries whose key starts with first_key_part, e.g. one city's maps
+        prefix = json.dumps([first_key_part], default=str)[:-1] + ','
+        with self._lock:
+            for key in [key for key in self._figures if key.startswith(prefix)]:
+                del self._figures[key]
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'backend_hits': self.backend_hits,
+                'misses': self.misses,
+                'size': len(self._figures),
+                'maxsize': self.maxsize,
+            }
+
+def create_figure_cache(maxsize, directory=None, redis_url=None):
+    backend = None
+    if redis_url:
+        import redis  # only needed when a Redis URL is configured
+        backend = RedisBackend(redis.Redis.from_url(redis_url))
+    elif directory:
+        backend = DiskBackend(directory)
+    return FigureCache(maxsize=maxsize, backend=backend)
@@ -0,0 +1,156 @@
+import argparse
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+import config
+from src.listings_cache import read_derived, write_derived
+
+# Batch forecasts of every neighbourhood's monthly mean price and rating. All series are fitted at
+# once on a (series x month) matrix: a least-squares linear trend, plus month-of-year offsets for the
+# months a series has seen at least twice. Prediction intervals come from the residual spread.
+
+MODEL_VERSION = 2
+FIT_ROUNDS = 5
+FORECAST_COLUMNS = {'mean_price': ('price_lower', 'price_upper'), 'mean_rating': ('rating_lower', 'rating_upper')}
+FORECAST_LIMITS = {'mean_price': (0, None), 'mean_rating': (0, 5)}
+
+def forecast_params():
+    return {'model': MODEL_VERSION, 'horizon': config.FORECAST_HORIZON, 'level': config.FORECAST_LEVEL,
+            'min_points': config.FORECAST_MIN_POINTS}
+
+def month_numbers(dates):
+    return dates.dt.year.to_numpy() * 12 + dates.dt.month.to_numpy() - 1
+
+def fit_series(values, months, origins, horizon, level):
+    # values is (series, months) with NaN where a series has no data, months the month number of each
+    # column and origins the last month of each series' city. Returns mean, lower and upper, each (series, horizon).
+    mask = ~np.isnan(values)
+    n = mask.sum(axis=1)
+    count = np.maximum(n, 1)
+
+    # Every sum is restricted to the observed months of a series
+    month_mean = (mask * months).sum(axis=1) / count
+    centred = np.where(mask, months - month_mean[:, None], 0.0)
+    spread = (centred ** 2).sum(axis=1)
+    calendar = (months % 12)[:, None] == np.arange(12)
+    seen = mask.astype('float64') @ calendar
+
+    # Trend and month-of-year offsets are fitted in turn (backfitting), so a season that
+    # correlates with time does not bend the trend. Offsets need a calendar month seen twice.
+    seasonal = np.zeros_like(seen)
+    for _ in range(FIT_ROUNDS):
+        deseasonalised = np.where(mask, values - seasonal[:, months % 12], 0.0)
+        value_mean = deseasonalised.sum(axis=1) / count
+        slope = np.divide((centred * deseasonalised).sum(axis=1), spread, out=np.zeros(len(values)), where=spread > 0)
+        intercept = value_mean - slope * month_mean
+        residuals = np.where(mask, values - (intercept[:, None] + slope[:, None] * months), 0.0)
+        seasonal = np.divide(residuals @ calendar, seen, out=np.zeros_like(seen), where=seen >= 2)
+
+    fitted = intercept[:, None] + slope[:, None] * months + seasonal[:, months % 12]
+    residuals = np.where(mask, values - fitted, 0.0)
+    freedom = np.maximum(n - 2 - (seen >= 2).sum(axis=1), 1)
+    sigma = np.sqrt((residuals ** 2).sum(axis=1) / freedom)
+
+    future = origins[:, None] + np.arange(1, horizon + 1)
+    mean = intercept[:, None] + slope[:, None] * future + np.take_along_axis(seasonal, future % 12, axis=1)
+    leverage = np.divide((future - month_mean[:, None]) ** 2, spread[:, None], out=np.zeros(future.shape), where=spread[:, None] > 0)
+    width = NormalDist().inv_cdf(0.5 + level / 2) * sigma[:, None] * np.sqrt(1 + 1 / count[:, None] + leverage)
+    return mean, mean - width, mean + width
+
+def monthly_means(frame, keys):
+    # One point per series and month: two scrapes in the same month are averaged, weighted by their listing counts
+    metrics = list(FORECAST_COLUMNS)
+    weights = {metric: frame['count'].where(frame[metric].notna(), 0) for metric in metrics}
+    parts = pd.DataFrame({**{metric: frame[metric].fillna(0) * weights[metric] for metric in metrics},
+                          **{metric + '_weight': weights[metric] for metric in metrics}})
+    sums = parts.groupby([frame[key] for key in keys + ['month_number']], observed=True).sum()
+    return pd.DataFrame({metric: sums[metric] / sums[metric + '_weight'].where(sums[metric + '_weight'] > 0)
+                         for metric in metrics})
+
+def build_forecasts(timeseries):
+    # timeseries as built by data_loader.build_timeseries; a 'city' column fits several cities in one pass
+    keys = [col for col in ('city', 'neighbourhood_cleansed') if col in timeseries.columns]
+    columns = keys + ['date', 'month'] + [col for metric, bounds in FORECAST_COLUMNS.items() for col in (metric,) + bounds]
+    if timeseries.empty:
+        return pd.DataFrame(columns=columns)
+
+    frame = timeseries.assign(month_number=month_numbers(timeseries['date']))
+    months = np.arange(frame['month_number'].min(), frame['month_number'].max() + 1)
+    matrix = monthly_means(frame, keys).unstack('month_number')
+    series = matrix.index.to_frame(index=False)
+
+    # Each series is forecast from the last date of its city, so a city's forecasts share their dates
+    if 'city' in keys:
+        origin_dates = pd.DatetimeIndex(series['city'].map(frame.groupby('city')['date'].max()))
+    else:
+        origin_dates = pd.DatetimeIndex([frame['date'].max()] * len(series))
+    origins = origin_dates.year.to_numpy() * 12 + origin_dates.month.to_numpy() - 1
+    forecast_any = np.zeros(len(series), dtype=bool)
+
+    horizon = config.FORECAST_HORIZON
+    steps = {origin: [origin + pd.DateOffset(months=step) for step in range(1, horizon + 1)] for origin in origin_dates.unique()}
+    forecasts = series.loc[series.index.repeat(horizon)].reset_index(drop=True)
+    forecasts['date'] = pd.DatetimeIndex([date for origin in origin_dates for date in steps[origin]])
+    forecasts['month'] = forecasts['date'].dt.month
+    for metric, (lower_column, upper_column) in FORECAST_COLUMNS.items():
+        values = matrix[metric].reindex(columns=months).to_numpy(dtype='float64')
+        # Counted per metric, a neighbourhood without ratings still gets a price forecast and vice versa
+        enough = (~np.isnan(values)).sum(axis=1) >= config.FORECAST_MIN_POINTS
+        forecast_any |= enough
+        mean, lower, upper = fit_series(values, months, origins, horizon, config.FORECAST_LEVEL)
+        low, high = FORECAST_LIMITS[metric]
+        for column, result in ((metric, mean), (lower_column, lower), (upper_column, upper)):
+            result = np.clip(result, low, high)
+            result[~enough] = np.nan
+            forecasts[column] = result.ravel()
+    forecasts = forecasts[np.repeat(forecast_any, horizon)].reset_index(drop=True)
+    return forecasts[columns]
+
+def load_forecasts(listings_path, timeseries):
+    # Persisted forecasts while the listings file is unchanged, otherwise (always without pyarrow) one vectorised fit of the city
+    if not config.FORECAST_ENABLED:
+        return None
+    forecasts = read_derived(listings_path, 'forecast', forecast_params())
+    if forecasts is not None:
+        return forecasts
+    forecasts = build_forecasts(timeseries)
+    if config.CACHE_WRITE_ON_MISS:
+        try:
+            write_derived(listings_path, 'forecast', forecasts, forecast_params())
+        except OSError as e:
+            print(f"Could not write forecasts for {listings_path}: {e}")
+    return forecasts
+
+def future_dates(unique_dates):
+    # The months after the last observed one, as shown on the month slider
+    if not config.FORECAST_ENABLED or len(unique_dates) == 0:
+        return []
+    last_date = max(unique_dates)
+    return [last_date + pd.DateOffset(months=step) for step in range(1, config.FORECAST_HORIZON + 1)]
+
+def build_all(city_paths):
+    # Offline stage: every city's series go through a single fit, then each city's forecasts are persisted
+    from src.data_loader import CityLoadError, read_city_listings, build_timeseries
+    timeseries = {}
+    for city, paths in city_paths.items():
+        try:
+            listings = read_city_listings(city, paths)
+        except CityLoadError as e:
+            print(e)
+            continue
+        timeseries[city] = build_timeseries(listings)
+    if not timeseries:
+        return
+
+    combined = pd.concat({city: frame.astype({'neighbourhood_cleansed': str}) for city, frame in timeseries.items()}, names=['city'])
+    forecasts = build_forecasts(combined.reset_index(level=0).reset_index(drop=True))
+    for city, city_forecasts in forecasts.groupby('city', sort=False):
+        city_forecasts = city_forecasts.drop(columns='city').astype({'neighbourhood_cleansed': 'category'})
+        write_derived(city_paths[city]['listings'], 'forecast', city_forecasts, forecast_params())
+        print(f"{city}: {city_forecasts['neighbourhood_cleansed'].nunique()} neighbourhoods forecast "
+              f"{config.FORECAST_HORIZON} months ahead")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fit and persist the price and rating forecasts of every city")
+    parser.parse_args()
+    build_all(config.CITY_PATHS)
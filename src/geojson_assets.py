@@ -0,0 +1,71 @@
+import gzip
+import hashlib
+import json
+import re
+import threading
+from flask import Response, abort, request
+import config
+
+class GeoJSONAssets:
+    # Serialised, gzipped geometry per city and data version (CityRegistry.version). Only the bodies are
+    # kept, and a city's entry is discarded when the city is evicted or refreshed.
+    def __init__(self):
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def get(self, city, geojson, version):
+        with self._lock:
+            asset = self._assets.get(city)
+        if asset is not None and asset['version'] == version:
+            return asset
+
+        body = json.dumps(geojson, separators=(',', ':')).encode('utf-8')
+        asset = {
+            'version': version,
+            'body': body,
+            'gzip': gzip.compress(body, compresslevel=9),
+            'etag': hashlib.sha1(body).hexdigest()[:16],
+        }
+        with self._lock:
+            self._assets[city] = asset
+        return asset
+
+    def discard(self, city):
+        with self._lock:
+            self._assets.pop(city, None)
+
+geojson_assets = GeoJSONAssets()
+
+def city_slug(city):
+    return re.sub(r'[^a-z0-9]+', '-', city.lower()).strip('-')
+
+def geojson_url(city, geojson, version):
+    # The content hash in the query string lets browsers cache the geometry indefinitely
+    asset = geojson_assets.get(city, geojson, version)
+    return f"{config.GEOJSON_ROUTE}{city_slug(city)}.json?v={asset['etag']}"
+
+def register_geojson_route(server, registry):
+    cities_by_slug = {city_slug(city): city for city in registry.city_paths}
+    registry.add_listener(geojson_assets.discard)
+    registry.add_eviction_listener(geojson_assets.discard)
+
+    @server.route(config.GEOJSON_ROUTE + '<slug>.json')
+    def serve_geojson(slug):
+        city = cities_by_slug.get(slug)
+        city_data = registry.get(city) if city else None
+        if city_data is None:
+            abort(404)
+
+        asset = geojson_assets.get(city, city_data.neighborhoods_geojson, city_data.version)
+        headers = {
+            'ETag': f'"{asset["etag"]}"',
+            'Cache-Control': 'public, max-age=31536000, immutable',
+            'Vary': 'Accept-Encoding',
+        }
+        if asset['etag'] in request.if_none_match:
+            return Response(status=304, headers=headers)
+
+        if 'gzip' in request.accept_encodings:
+            headers['Content-Encoding'] = 'gzip'
+            return Response(asset['gzip'], mimetype='application/geo+json', headers=headers)
+        return Response(asset['body'], mimetype='application/geo+json', headers=headers)
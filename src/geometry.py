@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+from collections import defaultdict
+import numpy as np
+import config
+
+# Polygons are cut into arcs at junctions (points where neighbouring rings diverge) and every
+# distinct arc is simplified once, so boundaries shared by two neighbourhoods stay identical.
+
+def polygon_rings(geometry):
+    if geometry is None:
+        return []
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+def round_polygons(geometry, precision):
+    polygons = []
+    for polygon in polygon_rings(geometry):
+        rings = [round_ring(ring, precision) for ring in polygon]
+        # A ring needs at least a closed triangle; a polygon without its exterior ring is dropped
+        if len(rings[0]) > 3:
+            polygons.append([ring for ring in rings if len(ring) > 3])
+    return polygons
+
+def round_ring(ring, precision):
+    points = []
+    for x, y in (point[:2] for point in ring):
+        point = (round(x, precision), round(y, precision))
+        if not points or point != points[-1]:
+            points.append(point)
+    if points and points[0] != points[-1]:
+        points.append(points[0])
+    return points
+
+def find_junctions(rings):
+    neighbours = defaultdict(set)
+    for ring in rings:
+        points = ring[:-1]
+        for i, point in enumerate(points):
+            neighbours[point].add(points[i - 1])
+            neighbours[point].add(points[(i + 1) % len(points)])
+    return {point for point, adjacent in neighbours.items() if len(adjacent) != 2}
+
+def rotate_to_min(points):
+    start = points.index(min(points))
+    return points[start:] + points[:start]
+
+def split_ring(ring, junctions):
+    points = ring[:-1]
+    cuts = [i for i, point in enumerate(points) if point in junctions]
+    if not cuts:
+        return None
+    points = points[cuts[0]:] + points[:cuts[0]]
+    cuts = [i - cuts[0] if i >= cuts[0] else i + len(points) - cuts[0] for i in cuts] + [len(points)]
+    points = points + [points[0]]
+    return [points[start:stop + 1] for start, stop in zip(cuts[:-1], cuts[1:])]
+
+def simplify_arc(points, tolerance):
+    if len(points) <= 2 or tolerance <= 0:
+        return points
+    coords = np.asarray(points)
+    keep = np.zeros(len(coords), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        start, stop = stack.pop()
+        if stop - start < 2:
+            continue
+        a, b = coords[start], coords[stop]
+        segment = coords[start + 1:stop]
+        direction = b - a
+        length = np.hypot(*direction)
+        if length == 0:
+            distances = np.hypot(*(segment - a).T)
+        else:
+            distances = np.abs(direction[0] * (segment[:, 1] - a[1]) - direction[1] * (segment[:, 0] - a[0])) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, stop))
+    return [points[i] for i in np.flatnonzero(keep)]
+
+class Topology:
+    def __init__(self, geojson, precision):
+        self.geojson = geojson
+        self.arcs = []
+        self._arc_ids = {}
+        self.features = []  # per feature: polygons -> rings -> signed arc ids
+
+        rounded = [round_polygons(feature.get('geometry'), precision) for feature in geojson['features']]
+        junctions = find_junctions([ring for polygons in rounded for polygon in polygons for ring in polygon])
+
+        for polygons in rounded:
+            self.features.append([[self._ring_arcs(ring, junctions) for ring in polygon] for polygon in polygons])
+
+    def _arc_id(self, points):
+        key = tuple(points)
+        if key in self._arc_ids:
+            return self._arc_ids[key]
+        reverse = tuple(reversed(points))
+        if reverse in self._arc_ids:
+            return ~self._arc_ids[reverse]
+        self._arc_ids[key] = len(self.arcs)
+        self.arcs.append(list(points))
+        return len(self.arcs) - 1
+
+    def _ring_arcs(self, ring, junctions):
+        pieces = split_ring(ring, junctions)
+        if pieces is not None:
+            return [self._arc_id(piece) for piece in pieces]
+
+        # Rings without junctions are normalised so the same ring in two features is one arc
+        points = ring[:-1]
+        forward = rotate_to_min(points)
+        backward = rotate_to_min(points[::-1])
+        if tuple(backward + backward[:1]) in self._arc_ids:
+            return [~self._arc_ids[tuple(backward + backward[:1])]]
+        return [self._arc_id(forward + forward[:1])]
+
+    def simplify(self, tolerance):
+        simplified = [simplify_arc(arc, tolerance) for arc in self.arcs]
+        # Give back the full detail to arcs of rings that would collapse below a triangle
+        for polygons in self.features:
+            for polygon in polygons:
+                for ring in polygon:
+                    if len(self._ring_points(ring, simplified)) < 4:
+                        for arc_id in ring:
+                            index = arc_id if arc_id >= 0 else ~arc_id
+                            simplified[index] = self.arcs[index]
+        self.arcs = simplified
+
+    def _ring_points(self, ring, arcs):
+        points = []
+        for arc_id in ring:
+            arc = arcs[arc_id] if arc_id >= 0 else arcs[~arc_id][::-1]
+            points.extend(arc if not points else arc[1:])
+        return points
+
+    def to_geojson(self, metadata=None):
+        features = []
+        for feature, polygons in zip(self.geojson['features'], self.features):
+            geometry = feature.get('geometry')
+            if geometry is not None and geometry['type'] in ('Polygon', 'MultiPolygon') and not polygons:
+                geometry = None
+            elif geometry is not None and geometry['type'] in ('Polygon', 'MultiPolygon'):
+                coordinates = [[[list(point) for point in self._ring_points(ring, self.arcs)] for ring in polygon] for polygon in polygons]
+                geometry = {'type': geometry['type'], 'coordinates': coordinates[0] if geometry['type'] == 'Polygon' else coordinates}
+            features.append({'type': 'Feature', 'properties': feature.get('properties'), 'geometry': geometry})
+        result = {'type': 'FeatureCollection', 'features': features}
+        if metadata:
+            result['simplification'] = metadata
+        return result
+
+    def to_topojson(self, quantization=100000):
+        points = np.array([point for arc in self.arcs for point in arc])
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0)
+        scale = [(x1 - x0) / (quantization - 1) or 1, (y1 - y0) / (quantization - 1) or 1]
+
+        arcs = []
+        for arc in self.arcs:
+            quantized = np.round((np.asarray(arc) - [x0, y0]) / scale).astype(int)
+            keep = np.concatenate(([True], np.any(quantized[1:] != quantized[:-1], axis=1)))
+            quantized = quantized[keep] if keep.sum() >= 2 else quantized[[0, -1]]
+            deltas = np.vstack((quantized[:1], np.diff(quantized, axis=0)))
+            arcs.append(deltas.tolist())
+
+        geometries = []
+        for feature, polygons in zip(self.geojson['features'], self.features):
+            geometry = feature.get('geometry')
+            if geometry is None or geometry['type'] not in ('Polygon', 'MultiPolygon') or not polygons:
+                geometries.append({'type': None, 'properties': feature.get('properties')})
+                continue
+            geometries.append({
+                'type': geometry['type'],
+                'arcs': polygons[0] if geometry['type'] == 'Polygon' else polygons,
+                'properties': feature.get('properties'),
+            })
+
+        return {
+            'type': 'Topology',
+            'transform': {'scale': scale, 'translate': [float(x0), float(y0)]},
+            'objects': {'neighbourhoods': {'type': 'GeometryCollection', 'geometries': geometries}},
+            'arcs': arcs,
+        }
+
+def simplification_settings():
+    return {'tolerance': config.GEOJSON_SIMPLIFY_TOLERANCE, 'precision': config.GEOJSON_PRECISION}
+
+def simplified_path(geojson_path, extension='.geojson'):
+    stem = os.path.splitext(os.path.basename(geojson_path))[0]
+    return os.path.join(config.CACHE_DIR, f'{stem}.simplified{extension}')
+
+def simplify_geojson(geojson, tolerance, precision):
+    topology = Topology(geojson, precision)
+    topology.simplify(tolerance)
+    return topology
+
+def load_geojson(geojson_path):
+    # Use the preprocessed geometry when it was built after the source last changed
+    path = simplified_path(geojson_path)
+    if config.GEOJSON_USE_SIMPLIFIED and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(geojson_path):
+        geojson_path = path
+    with open(geojson_path, 'r') as file:
+        return json.load(file)
+
+def count_vertices(geojson):
+    return sum(len(ring) for feature in geojson['features'] for polygon in polygon_rings(feature.get('geometry')) for ring in polygon)
+
+def build_simplified(city_paths, topojson=False):
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    settings = simplification_settings()
+    for city, paths in city_paths.items():
+        try:
+            with open(paths['geojson'], 'r') as file:
+                geojson = json.load(file)
+        except FileNotFoundError:
+            print(f"GeoJSON file for {city} not found at {paths['geojson']}")
+            continue
+
+        topology = simplify_geojson(geojson, settings['tolerance'], settings['precision'])
+        simplified = topology.to_geojson(metadata=settings)
+        output = simplified_path(paths['geojson'])
+        with open(output, 'w') as file:
+            json.dump(simplified, file, separators=(',', ':'))
+
+        original_size = os.path.getsize(paths['geojson'])
+        report = (f"{city}: {original_size / 1e3:.0f} KB -> {os.path.getsize(output) / 1e3:.0f} KB GeoJSON "
+                  f"({100 * (1 - os.path.getsize(output) / original_size):.0f}% smaller), "
+                  f"{count_vertices(geojson)} -> {count_vertices(simplified)} vertices")
+        if topojson:
+            topojson_output = simplified_path(paths['geojson'], '.topojson')
+            with open(topojson_output, 'w') as file:
+                json.dump(topology.to_topojson(), file, separators=(',', ':'))
+            report += f", {os.path.getsize(topojson_output) / 1e3:.0f} KB TopoJSON"
+        print(report)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simplify and quantise the neighbourhood GeoJSON files")
+    parser.add_argument('--tolerance', type=float, help="simplification tolerance in degrees")
+    parser.add_argument('--precision', type=int, help="decimal places kept in coordinates")
+    parser.add_argument('--topojson', action='store_true', help="also write a TopoJSON file per city")
+    args = parser.parse_args()
+    if args.tolerance is not None:
+        config.GEOJSON_SIMPLIFY_TOLERANCE = args.tolerance
+    if args.precision is not None:
+        config.GEOJSON_PRECISION = args.precision
+    build_simplified(config.CITY_PATHS, topojson=args.topojson)
@@ -1,14 +1,23 @@
-from dash import html, dcc
+from dash import html, dcc, dash_table
 import dash_bootstrap_components as dbc
-from src.utils import get_city_options, get_unique_dates
+from src.utils import get_city_options, get_date_marks, generate_paged_table
+from src import data_loader
 import config
 
 def create_layout():
+    if not data_loader.data_ready.wait(config.READY_WAIT_SECONDS):
+        return html.Div("The dashboard is still loading its data, please reload the page in a few seconds.",
+                        style={'padding': '40px', 'fontSize': '20px', 'textAlign': 'center'})
+
     city_options = get_city_options(config.CITY_PATHS)
-    unique_dates = get_unique_dates(config.CITY_PATHS)
-    date_marks = {i: date.strftime('%Y-%m') for i, date in enumerate(sorted(unique_dates))}
+    date_marks = get_date_marks(data_loader.unique_dates)
 
-    if len(date_marks) > 2:
+    if data_loader.forecast_dates:
+        for key, label in date_marks.items():
+            if label in data_loader.forecast_dates:
+                date_marks[key] += " (Forecasted)"
+    elif len(date_marks) > 2:
+        # Without forecasts the last two months of the data are the forecast
         last_key = max(date_marks.keys())
         date_marks[last_key - 1] += " (Forecasted)"
         date_marks[last_key] += " (Forecasted)"
@@ -74,6 +83,55 @@ def create_layout():
             style={'padding': '10px', 'backgroundColor': config.COLORS['background']}
         ),
 
+        # Listing search section
+        html.Div(
+            [
+                html.H2("SEARCH LISTINGS", style={'fontSize': '19px', 'fontWeight': '580', 'textAlign': 'center', 'color': '#7F7F7F'}),
+                html.Div([
+                    dcc.Input(
+                        id='search-input',
+                        type='search',
+                        placeholder='Listing name, host or category',
+                        debounce=False,
+                        style={'width': '350px', 'margin': '10px', 'borderRadius': '10px', 'padding': '6px 10px', 'fontSize': '15px', 'border': '1px solid #CCCCCC'}
+                    ),
+                    dcc.RadioItems(
+                        id='search-rank',
+                        options=[{'label': ' Rating', 'value': 'review_scores_rating'}, {'label': ' Reviews', 'value': 'number_of_reviews'}],
+                        value='review_scores_rating',
+                        inline=True,
+                        inputStyle={'marginLeft': '15px', 'marginRight': '5px'},
+                        style={'display': 'inline-block', 'fontSize': '14px', 'color': config.COLORS['text']}
+                    ),
+                ], style={'textAlign': 'center'}),
+                dash_table.DataTable(
+                    id='search-results',
+                    style_header={'backgroundColor': config.COLORS['primary'], 'color': 'white', 'fontWeight': 'bold', 'border': 'none'},
+                    style_cell={'fontFamily': 'Arial', 'fontSize': '12px', 'color': config.COLORS['text'], 'textAlign': 'left',
+                                'padding': '6px', 'border': f"1px solid {config.COLORS['background']}", 'maxWidth': '320px',
+                                'overflow': 'hidden', 'textOverflow': 'ellipsis'},
+                    style_table={'width': '80%', 'margin': '0 auto'},
+                ),
+            ],
+            style={'padding': '10px', 'backgroundColor': config.COLORS['background']}
+        ) if config.SEARCH_ENABLED else None,
+
+        # Cross-city comparison section
+        html.Div(
+            [
+                html.H2("COMPARE CITIES", style={'fontSize': '19px', 'fontWeight': '580', 'textAlign': 'center', 'color': '#7F7F7F'}),
+                dcc.Dropdown(
+                    id='comparison-cities',
+                    options=city_options,
+                    value=config.COMPARISON_CITIES,
+                    multi=True,
+                    style={'width': '60%', 'margin': '10px auto', 'borderRadius': '10px', 'padding': '1px', 'fontSize': '15px'}
+                ),
+                dcc.Graph(id='comparison-graph', style={'width': '80%', 'margin': '0 auto'}),
+            ],
+            style={'padding': '10px', 'backgroundColor': config.COLORS['background']}
+        ),
+
         # Store to hold the clicked neighborhood value
         dcc.Store(id='clicked-neighborhood'),
 
@@ -106,6 +164,8 @@ def create_layout():
                                 searchable=True
                             ),
                             dcc.Graph(id='scatter-plot'),
+                            # Price and rating figures of the selected neighbourhood
+                            dcc.Store(id='scatter-series'),
                         ], style={'padding': '20px', 'boxShadow': '0px 4px 10px rgba(0, 0, 0, 0.1)', 'borderRadius': '10px', 'marginTop': '20px'}),
                         
                         
@@ -147,7 +207,21 @@ def create_layout():
                         ], style={'margin': '20px 0'}),
 
            
-                        html.Div(id='table-container', style={'padding': '20px', 'boxShadow': '0px 4px 10px rgba(0, 0, 0, 0.1)', 'borderRadius': '10px'})
+                        html.Div(id='table-container', children=generate_paged_table() if config.TABLE_MODE == 'paged' else None, style={'padding': '20px', 'boxShadow': '0px 4px 10px rgba(0, 0, 0, 0.1)', 'borderRadius': '10px'}),
+
+                        # Links to the export route, kept in step with the table's selection in the browser
+                        html.Div([
+                            dcc.Store(id='export-route', data=config.EXPORT_ROUTE),
+                            dcc.Checklist(
+                                id='export-scope',
+                                options=[{'label': ' All months and neighbourhoods', 'value': 'all'}],
+                                value=[],
+                                inputStyle={'marginRight': '5px'},
+                                style={'display': 'inline-block', 'marginRight': '20px', 'fontSize': '14px', 'color': config.COLORS['text']}
+                            ),
+                            dbc.Button("Download CSV", id='export-csv', href='', external_link=True, className='mr-2', style={'backgroundColor': '#FFFFFF','color': '#FF5A5F','border': '1px solid #FF5A5F','outline': 'none','boxShadow': 'none'}),
+                            dbc.Button("Download Parquet", id='export-parquet', href='', external_link=True, style={'backgroundColor': '#FFFFFF','color': '#FF5A5F','border': '1px solid #FF5A5F','outline': 'none','boxShadow': 'none'}),
+                        ], style={'textAlign': 'right', 'marginTop': '15px'})
                     ]
                 ),
             ],
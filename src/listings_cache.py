@@ -0,0 +1,265 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+import pandas as pd
+import config
+from src.partitions import sort_for_partitions
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # Without pyarrow every load goes through the CSV parse
+    pa = feather = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent builds then just repeat the work
+    fcntl = None
+
+CACHE_FORMAT = 2  # 2: a single record batch, float columns store NaN as a value rather than a null
+
+def cache_paths(listings_path):
+    stem = os.path.splitext(os.path.basename(listings_path))[0]
+    return (os.path.join(config.CACHE_DIR, stem + '.feather'),
+            os.path.join(config.CACHE_DIR, stem + '.json'))
+
+def derived_paths(listings_path, name):
+    stem = os.path.splitext(os.path.basename(listings_path))[0]
+    return (os.path.join(config.CACHE_DIR, f'{stem}.{name}.feather'),
+            os.path.join(config.CACHE_DIR, f'{stem}.{name}.json'))
+
+def temp_path(path):
+    # Unique per writer, so threads of one worker building the same city never rename each other's file
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def source_signature(listings_path):
+    stat = os.stat(listings_path)
+    signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if config.CACHE_VERIFY_HASH:
+        signature['sha1'] = file_sha1(listings_path)
+    return signature
+
+def read_meta(listings_path):
+    _, meta_path = cache_paths(listings_path)
+    try:
+        with open(meta_path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):  # missing, or an unreadable cache directory
+        return None
+
+def is_fresh(listings_path, meta):
+    if (meta is None or meta.get('format') != CACHE_FORMAT or meta.get('columns') != config.LISTINGS_COLUMNS
+            or meta.get('dtypes') != config.LISTINGS_DTYPES):
+        return False
+    return matches_source(listings_path, meta['source'])
+
+def matches_source(listings_path, source):
+    stat = os.stat(listings_path)
+    if stat.st_size != source['size']:
+        return False
+    if stat.st_mtime_ns == source['mtime_ns']:
+        return True
+    # A checkout or copy touches the mtime without changing the data
+    return 'sha1' in source and file_sha1(listings_path) == source['sha1']
+
+def apply_schema(listings):
+    dtypes = {}
+    for col, dtype in config.LISTINGS_DTYPES.items():
+        if col not in listings.columns or listings[col].dtype == dtype:
+            continue
+        if dtype.startswith('int') and listings[col].isna().any():
+            # float32 only holds 24 bits exactly, 64-bit ids keep their digits as nullable integers
+            dtype = 'Int64' if dtype == 'int64' else 'float32'
+        dtypes[col] = dtype
+    return listings.astype(dtypes) if dtypes else listings
+
+def read_listings_csv(listings_path):
+    wanted = set(config.LISTINGS_COLUMNS)
+    # Read as nullable integers, a gap would otherwise turn the column into float64 and round the ids
+    wide_integers = {col: 'Int64' for col, dtype in config.LISTINGS_DTYPES.items() if dtype == 'int64'}
+    with open(listings_path, 'r', encoding='utf-8', errors='replace') as file:
+        listings = pd.read_csv(file, usecols=lambda col: col in wanted, parse_dates=['date'], dtype=wide_integers)
+    listings = listings.dropna(subset=['neighbourhood_cleansed', 'price'])
+    listings['month'] = listings['date'].dt.month
+    listings = apply_schema(listings)
+    # Stored pre-sorted so loading the cache needs no sort before building the partition index
+    return sort_for_partitions(listings[config.LISTINGS_COLUMNS])
+
+def read_cached_dates(listings_path):
+    meta = read_meta(listings_path)
+    if meta is not None and 'dates' in meta and is_fresh(listings_path, meta):
+        return pd.to_datetime(meta['dates'])
+    # A city whose listings were never cached has the manifest left by a scan of its date column
+    _, manifest_path = derived_paths(listings_path, 'dates')
+    try:
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not matches_source(listings_path, manifest['source']):
+        return None
+    return pd.to_datetime(manifest['dates'])
+
+def write_date_manifest(listings_path, dates):
+    # Kept apart from the listings sidecar, which also vouches for the Feather file next to it
+    _, manifest_path = derived_paths(listings_path, 'dates')
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    manifest = {'source': source_signature(listings_path),
+                'dates': [date.strftime('%Y-%m-%d') for date in sorted(pd.to_datetime(dates))]}
+    with open(temp_path(manifest_path), 'w') as file:
+        json.dump(manifest, file)
+    os.replace(temp_path(manifest_path), manifest_path)
+
+def is_cached(listings_path):
+    # A Feather file that matches the CSV, so loading the city needs no parse
+    if feather is None or not os.path.exists(listings_path):
+        return False
+    feather_path, _ = cache_paths(listings_path)
+    return os.path.exists(feather_path) and is_fresh(listings_path, read_meta(listings_path))
+
+def read_cached_listings(listings_path):
+    if not is_cached(listings_path):
+        return None
+    feather_path, _ = cache_paths(listings_path)
+    table = feather.read_table(feather_path, columns=config.LISTINGS_COLUMNS, memory_map=True)
+    if config.SHARED_DATASET:
+        # One block per column keeps numeric and date columns, and the codes of categorical ones, zero-copy
+        # views of the mapped file. Arrow nulls (missing ids) and the category strings are still copied.
+        return table.to_pandas(split_blocks=True)
+    return table.to_pandas()
+
+def listings_table(listings):
+    # Arrow turns NaN into nulls, and a column with nulls is copied on every read to put the NaN back.
+    # Kept as values, float columns with gaps map without a copy like the others.
+    table = pa.Table.from_pandas(listings, preserve_index=False)
+    for number, col in enumerate(listings.columns):
+        if listings[col].dtype.kind == 'f':
+            table = table.set_column(number, col, pa.array(listings[col].to_numpy(), from_pandas=False))
+    return table
+
+def write_cached_listings(listings_path, listings):
+    feather_path, meta_path = cache_paths(listings_path)
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    # The sidecar doubles as the date manifest, so it is written even without pyarrow
+    meta = {
+        'source': source_signature(listings_path),
+        'format': CACHE_FORMAT,
+        'columns': config.LISTINGS_COLUMNS,
+        'dtypes': config.LISTINGS_DTYPES,
+        'rows': len(listings),
+        'dates': [date.strftime('%Y-%m-%d') for date in sorted(listings['date'].unique())],
+    }
+
+    # Write next to the target and rename so concurrent workers never read a partial file
+    if feather is not None:
+        # One record batch: a column split across batches is concatenated, i.e. copied, when read
+        feather.write_feather(listings_table(listings), temp_path(feather_path), compression=config.CACHE_COMPRESSION,
+                              chunksize=max(len(listings), 1))
+    with open(temp_path(meta_path), 'w') as file:
+        json.dump(meta, file)
+    if feather is not None:
+        os.replace(temp_path(feather_path), feather_path)
+    os.replace(temp_path(meta_path), meta_path)
+    return feather is not None
+
+def read_derived(listings_path, name, params):
+    # A frame computed from a city's listings (stats, forecasts), while the CSV and the params are unchanged
+    if feather is None:
+        return None
+    frame_path, meta_path = derived_paths(listings_path, name)
+    try:
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+    except (OSError, ValueError):  # missing, or an unreadable cache directory
+        return None
+    if meta.get('params') != params or not matches_source(listings_path, meta['source']) or not os.path.exists(frame_path):
+        return None
+    return feather.read_feather(frame_path)
+
+def write_derived(listings_path, name, frame, params):
+    if feather is None:
+        return
+    frame_path, meta_path = derived_paths(listings_path, name)
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    meta = {'source': source_signature(listings_path), 'params': params, 'rows': len(frame)}
+    feather.write_feather(frame.reset_index(drop=True), temp_path(frame_path))
+    with open(temp_path(meta_path), 'w') as file:
+        json.dump(meta, file)
+    os.replace(temp_path(frame_path), frame_path)
+    os.replace(temp_path(meta_path), meta_path)
+
+def load_listings(listings_path):
+    if not os.path.exists(listings_path):
+        raise FileNotFoundError(listings_path)
+
+    listings = read_cached_listings(listings_path)
+    if listings is not None:
+        return listings
+
+    listings = read_listings_csv(listings_path)
+    if config.CACHE_WRITE_ON_MISS:
+        try:
+            write_cached_listings(listings_path, listings)
+        except OSError as e:
+            print(f"Could not write listings cache for {listings_path}: {e}")
+    return listings
+
+@contextmanager
+def build_lock():
+    # Worker processes starting together wait for the first one instead of all parsing the CSVs
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    with open(os.path.join(config.CACHE_DIR, '.build.lock'), 'w') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+def build_cache(city_paths, force=False):
+    if feather is None:
+        print("pyarrow is not installed, only the date manifests will be written")
+
+    with build_lock():
+        build_cities(city_paths, force)
+
+def build_cities(city_paths, force):
+    for city, paths in city_paths.items():
+        listings_path = paths['listings']
+        if not os.path.exists(listings_path):
+            print(f"Listings CSV file for {city} not found at {listings_path}")
+            continue
+        feather_path, _ = cache_paths(listings_path)
+        has_feather = feather is None or os.path.exists(feather_path)
+        if not force and has_feather and is_fresh(listings_path, read_meta(listings_path)):
+            print(f"{city}: cache is up to date")
+            continue
+
+        try:
+            listings = read_listings_csv(listings_path)
+        except ValueError as e:
+            print(f"{city}: could not parse {listings_path}: {e}")
+            continue
+        if not write_cached_listings(listings_path, listings):
+            print(f"{city}: {len(listings)} rows, date manifest written")
+            continue
+        print(f"{city}: {len(listings)} rows, "
+              f"{os.path.getsize(listings_path) / 1e6:.1f} MB CSV -> {os.path.getsize(feather_path) / 1e6:.1f} MB cache")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the listings CSVs into the columnar cache")
+    parser.add_argument('--force', action='store_true', help="rebuild even when the cache is up to date")
+    args = parser.parse_args()
+    build_cache(config.CITY_PATHS, force=args.force)
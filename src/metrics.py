@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from functools import wraps
+from flask import Response
+from dash.exceptions import PreventUpdate
+import config
+
+# Opt-in callback instrumentation (config.METRICS_ENABLED). Each callback's wall time is split into
+# the phases marked with `with phase(...)` inside it, 'other' for the unmarked rest of the function
+# and 'serialise' for Dash turning the result into the JSON response. Without instrumentation
+# phase() and cache_event() only look up a thread-local and return.
+#
+# Metrics are kept per process; with several gunicorn workers each scrape sees one worker.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 5e6)
+
+_local = threading.local()
+_no_phase = nullcontext()
+
+class CallbackRecord:
+    # Timings of one callback invocation, owned by the thread running it
+    def __init__(self, name):
+        self.name = name
+        self.args = ()
+        self.phases = defaultdict(float)
+        self.caches = defaultdict(int)
+        self.function_seconds = 0.0
+        self.current = None
+        self._mark = None
+
+    def switch(self, phase):
+        # Phases are exclusive: entering a nested phase pauses the enclosing one
+        now = time.perf_counter()
+        if self.current is not None:
+            self.phases[self.current] += now - self._mark
+        previous, self.current, self._mark = self.current, phase, now
+        return previous
+
+class Phase:
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = self.record.switch(self.name)
+
+    def __exit__(self, *exc):
+        self.record.switch(self.previous)
+
+def phase(name):
+    record = getattr(_local, 'record', None)
+    if record is None or record.current is None:
+        return _no_phase
+    return Phase(record, name)
+
+def cache_event(cache, result):
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record.caches[(cache, result)] += 1
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def lines(self, metric, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{metric}_count{{{labels}}} {cumulative}')
+        return lines
+
+class CallbackMetrics:
+    def __init__(self):
+        self.calls = defaultdict(int)  # (callback, outcome)
+        self.durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self.sizes = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.phases = defaultdict(float)  # (callback, phase)
+        self.caches = defaultdict(int)  # (callback, cache, result)
+        self._lock = threading.Lock()
+
+    def observe(self, record, outcome, seconds, size):
+        with self._lock:
+            self.calls[(record.name, outcome)] += 1
+            self.durations[record.name].observe(seconds)
+            if size is not None:
+                self.sizes[record.name].observe(size)
+            for name, phase_seconds in record.phases.items():
+                self.phases[(record.name, name)] += phase_seconds
+            for (cache, result), count in record.caches.items():
+                self.caches[(record.name, cache, result)] += count
+
+    def render(self):
+        with self._lock:
+            lines = [
+                '# HELP dash_callback_calls_total Callback invocations by outcome (ok, prevented, error).',
+                '# TYPE dash_callback_calls_total counter',
+            ]
+            lines += [f'dash_callback_calls_total{{callback="{name}",outcome="{outcome}"}} {count}'
+                      for (name, outcome), count in sorted(self.calls.items())]
+            lines += [
+                '# HELP dash_callback_duration_seconds Callback wall time including serialisation of the response.',
+                '# TYPE dash_callback_duration_seconds histogram',
+            ]
+            for name, histogram in sorted(self.durations.items()):
+                lines += histogram.lines('dash_callback_duration_seconds', f'callback="{name}"')
+            lines += [
+                '# HELP dash_callback_phase_seconds_total Callback wall time by phase.',
+                '# TYPE dash_callback_phase_seconds_total counter',
+            ]
+            lines += [f'dash_callback_phase_seconds_total{{callback="{name}",phase="{phase_name}"}} {seconds:.6f}'
+                      for (name, phase_name), seconds in sorted(self.phases.items())]
+            lines += [
+                '# HELP dash_callback_response_bytes Size of the JSON response of a callback.',
+                '# TYPE dash_callback_response_bytes histogram',
+            ]
+            for name, histogram in sorted(self.sizes.items()):
+                lines += histogram.lines('dash_callback_response_bytes', f'callback="{name}"')
+            lines += [
+                '# HELP dash_callback_cache_total Cache lookups made while a callback ran.',
+                '# TYPE dash_callback_cache_total counter',
+            ]
+            lines += [f'dash_callback_cache_total{{callback="{name}",cache="{cache}",result="{result}"}} {count}'
+                      for (name, cache, result), count in sorted(self.caches.items())]
+        return '\n'.join(lines) + '\n'
+
+metrics = CallbackMetrics()
+
+def log_slow(record, seconds, size):
+    phases = ', '.join(f'{name} {value * 1000:.1f} ms' for name, value in sorted(record.phases.items(), key=lambda item: -item[1]))
+    inputs = repr(record.args)
+    if len(inputs) > 200:
+        inputs = inputs[:197] + '...'
+    print(f"Slow callback {record.name}: {seconds * 1000:.1f} ms ({phases}), {size or 0} bytes, inputs {inputs}")
+
+def timed_function(func):
+    # Runs inside Dash's wrapper, so its time excludes serialisation of the response
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        record = getattr(_local, 'record', None)
+        if record is None:
+            return func(*args, **kwargs)
+        record.args = args
+        start = time.perf_counter()
+        record.switch('other')
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record.switch(None)
+            record.function_seconds = time.perf_counter() - start
+    return wrapper
+
+def timed_dispatch(name, dispatch):
+    # Wraps Dash's registered callback, which calls the function and serialises its output
+    @wraps(dispatch)
+    def wrapper(*args, **kwargs):
+        record = CallbackRecord(name)
+        _local.record = record
+        outcome, response = 'error', None
+        start = time.perf_counter()
+        try:
+            response = dispatch(*args, **kwargs)
+            outcome = 'ok'
+            return response
+        except PreventUpdate:
+            outcome = 'prevented'
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            _local.record = None
+            if record.function_seconds:
+                record.phases['serialise'] += max(0.0, seconds - record.function_seconds)
+            size = len(response.encode('utf-8')) if isinstance(response, str) else None
+            metrics.observe(record, outcome, seconds, size)
+            if config.SLOW_CALLBACK_MS is not None and seconds * 1000 >= config.SLOW_CALLBACK_MS:
+                log_slow(record, seconds, size)
+    return wrapper
+
+def instrument_app(app):
+    # Must run before the callbacks are registered: every app.callback registration is wrapped
+    register = app.callback
+
+    def callback(*args, **kwargs):
+        # Dash adds the callback map entry here and its dispatch function once the decorator is applied
+        known = set(app.callback_map)
+        decorator = register(*args, **kwargs)
+        outputs = set(app.callback_map) - known
+
+        def instrument(func):
+            decorator(timed_function(func))
+            for output in outputs:
+                app.callback_map[output]['callback'] = timed_dispatch(func.__name__, app.callback_map[output]['callback'])
+            return func
+        return instrument
+
+    app.callback = callback
+
+    @app.server.route(config.METRICS_ROUTE)
+    def serve_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from src.metrics import cache_event
+
+PARTITION_COLUMNS = ['neighbourhood_cleansed', 'month', 'date']
+
+def sort_for_partitions(listings):
+    return listings.sort_values(PARTITION_COLUMNS, kind='stable').reset_index(drop=True)
+
+def is_partitioned(listings):
+    if len(listings) < 2:
+        return True
+    neighbourhoods = listings['neighbourhood_cleansed']
+    if isinstance(neighbourhoods.dtype, pd.CategoricalDtype) and neighbourhoods.cat.categories.is_monotonic_increasing:
+        # Codes follow the lexical order, so the check never materialises the strings
+        neighbourhoods = neighbourhoods.cat.codes
+    neighbourhoods = neighbourhoods.to_numpy()
+    months = listings['month'].to_numpy()
+    same_neighbourhood = neighbourhoods[1:] == neighbourhoods[:-1]
+    return bool(np.all(neighbourhoods[1:] >= neighbourhoods[:-1])
+                and np.all(~same_neighbourhood | (months[1:] >= months[:-1])))
+
+class PartitionIndex:
+    # Row ranges of a listings frame sorted by neighbourhood and month, so a filter is a slice
+    def __init__(self, listings, order_cache_size=0):
+        self.listings = listings
+        self.ranges = {}
+        self.neighbourhood_ranges = {}
+        self.order_cache_size = order_cache_size
+        self._orders = OrderedDict()
+        self._lock = threading.Lock()
+        if listings.empty:
+            return
+
+        neighbourhoods = listings['neighbourhood_cleansed']
+        # Categorical codes make the boundary scan an integer comparison
+        keys = neighbourhoods.cat.codes.to_numpy() if isinstance(neighbourhoods.dtype, pd.CategoricalDtype) else neighbourhoods.to_numpy()
+        neighbourhoods = neighbourhoods.to_numpy()
+        months = listings['month'].to_numpy()
+        boundaries = np.flatnonzero((keys[1:] != keys[:-1]) | (months[1:] != months[:-1])) + 1
+        starts = np.concatenate(([0], boundaries))
+        stops = np.concatenate((boundaries, [len(listings)]))
+
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            neighbourhood = neighbourhoods[start]
+            self.ranges[(neighbourhood, int(months[start]))] = (start, stop)
+            first, _ = self.neighbourhood_ranges.get(neighbourhood, (start, stop))
+            self.neighbourhood_ranges[neighbourhood] = (first, stop)
+
+    def __getstate__(self):
+        # Sort orders and the lock stay behind when a loaded city is sent between processes
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_orders'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def bounds(self, neighbourhood, month=None):
+        if month is None:
+            return self.neighbourhood_ranges.get(neighbourhood, (0, 0))
+        return self.ranges.get((neighbourhood, month), (0, 0))
+
+    def rows(self, neighbourhood, month=None):
+        start, stop = self.bounds(neighbourhood, month)
+        return self.listings.iloc[start:stop]
+
+    def size(self, neighbourhood, month=None):
+        start, stop = self.bounds(neighbourhood, month)
+        return stop - start
+
+    def sort_order(self, neighbourhood, month, column):
+        # Ascending row positions of one partition with missing values last, kept in a small LRU
+        key = (neighbourhood, month, column)
+        with self._lock:
+            if key in self._orders:
+                self._orders.move_to_end(key)
+                cache_event('sort_order', 'hit')
+                return self._orders[key]
+
+        cache_event('sort_order', 'miss')
+        start, stop = self.bounds(neighbourhood, month)
+        values = self.listings[column].iloc[start:stop].reset_index(drop=True)
+        positions = values.sort_values(kind='stable').index.to_numpy() + start
+        order = (positions, int(values.notna().sum()))
+
+        with self._lock:
+            self._orders[key] = order
+            while len(self._orders) > self.order_cache_size:
+                self._orders.popitem(last=False)
+        return order
+
+    def positions(self, neighbourhood=None, month=None):
+        # Row positions of a selection, None for either part meaning all neighbourhoods or all months
+        if neighbourhood is not None:
+            start, stop = self.bounds(neighbourhood, month)
+            return np.arange(start, stop)
+        if month is None:
+            return np.arange(len(self.listings))
+        return np.flatnonzero(self.listings['month'].to_numpy() == month)
+
+    def sorted_positions(self, neighbourhood, month, column, ascending):
+        # Every row position of a selection in table order, missing values last in both directions
+        if neighbourhood is not None and self.order_cache_size > 0:
+            positions, valid = self.sort_order(neighbourhood, month, column)
+        else:
+            positions = self.positions(neighbourhood, month)
+            values = self.listings[column].take(positions).reset_index(drop=True)
+            positions = positions[values.sort_values(kind='stable').index.to_numpy()]
+            valid = int(values.notna().sum())
+        if not ascending:
+            positions = np.concatenate((positions[:valid][::-1], positions[valid:]))
+        return positions
+
+    def top_positions(self, neighbourhood, month, column, ascending, limit):
+        # Partial selection for when no sort orders are cached
+        start, stop = self.bounds(neighbourhood, month)
+        values = self.listings[column].iloc[start:stop].reset_index(drop=True)
+        if limit is None or not pd.api.types.is_numeric_dtype(values):
+            return values.sort_values(ascending=ascending, kind='stable').index.to_numpy()[:limit] + start
+        selected = values.nsmallest(limit) if ascending else values.nlargest(limit)
+        positions = selected.index.to_numpy()
+        if len(positions) < limit:
+            missing = values.index[values.isna()].to_numpy()
+            positions = np.concatenate((positions, missing[:limit - len(positions)]))
+        return positions + start
+
+    def sorted_rows(self, neighbourhood, month, column, ascending, columns, start=0, stop=None):
+        if self.order_cache_size > 0:
+            positions, valid = self.sort_order(neighbourhood, month, column)
+            if not ascending:
+                positions = np.concatenate((positions[:valid][::-1], positions[valid:]))
+            positions = positions[start:stop]
+        else:
+            positions = self.top_positions(neighbourhood, month, column, ascending, stop)[start:]
+
+        # Only the requested rows and columns are copied out of the partition
+        column_positions = [self.listings.columns.get_loc(col) for col in columns]
+        return self.listings.iloc[positions, column_positions]
@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+
+class DataWatcher:
+    # Polls the data files of every city and refreshes a city once its files stop changing,
+    # so a file that is still being copied is not read half-written
+    def __init__(self, registry, interval):
+        self.registry = registry
+        self.interval = interval
+        self._signatures = {city: self.signature(paths) for city, paths in registry.city_paths.items()}
+        self._pending = {}
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(paths):
+        signature = []
+        for path in (paths['listings'], paths['geojson']):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def check(self):
+        refreshed = []
+        for city, paths in self.registry.city_paths.items():
+            signature = self.signature(paths)
+            if signature == self._signatures[city]:
+                self._pending.pop(city, None)
+            elif self._pending.get(city) != signature:
+                self._pending[city] = signature
+            else:
+                del self._pending[city]
+                self._signatures[city] = signature
+                print(f"Data files of {city} changed, refreshing")
+                self.registry.refresh(city)
+                refreshed.append(city)
+        return refreshed
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Data refresh failed: {e}")
+
+    def start(self):
+        # Threads do not survive a fork, so every worker process starts its own watcher
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='data-watcher', daemon=True)
+            self._thread.start()
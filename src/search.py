@@ -0,0 +1,132 @@
+import re
+import sys
+from bisect import bisect_left
+import numpy as np
+import pandas as pd
+import config
+
+# Inverted index over the text columns of one city. Every listing appears once, as its latest row.
+# The columns are categorical, so each distinct string is tokenised once and its tokens point to
+# a category code; the rows of a code are a slice of a code-sorted position array. A query token
+# matches every indexed token it is a prefix of.
+
+SEARCH_COLUMNS = ['name', 'host_name', 'category']
+RANK_COLUMNS = ['review_scores_rating', 'number_of_reviews']
+RESULT_COLUMNS = ['name', 'host_name', 'category', 'neighbourhood_cleansed', 'price', 'review_scores_rating', 'number_of_reviews', 'id']
+
+TOKEN_PATTERN = re.compile(r'\w+')
+DIRECT_LOOKUP_CODES = 32  # strings matched by a query word above which rows are found by a scan of the codes
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+class ColumnPostings:
+    # Rows of each category code of one column, as slices of one sorted array. Sized by the categories,
+    # a category only used by older rows of a listing is indexed but has no rows.
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.positions = np.argsort(codes, kind='stable').astype('int32')
+        self.offsets = np.searchsorted(codes[self.positions], np.arange(categories + 1)).astype('int32')
+
+    def rows(self, codes):
+        if len(codes) <= DIRECT_LOOKUP_CODES:
+            return np.concatenate([self.positions[self.offsets[code]:self.offsets[code + 1]] for code in codes])
+        # A word shared by many strings (e.g. 'flat') is one pass over the codes instead;
+        # the extra False slot is where missing values (code -1) land
+        hit = np.zeros(len(self.offsets), dtype=bool)
+        hit[codes] = True
+        return np.flatnonzero(hit[self.codes])
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.positions.nbytes + self.offsets.nbytes
+
+class SearchIndex:
+    def __init__(self, listings):
+        self.listings = listings
+        self.tokens = []  # sorted vocabulary
+        self.postings = {}  # token -> {column number: category codes}
+        self.columns = []
+        self.rank_values = {}
+        columns = [col for col in SEARCH_COLUMNS if col in listings.columns]
+        if listings.empty or not columns:
+            self.rows = np.empty(0, dtype='int64')
+            self.nbytes = 0
+            return
+
+        # The latest row of each listing represents it; a row without an id stands for itself
+        missing = listings['id'].isna().to_numpy()
+        ids = listings['id'].to_numpy(dtype='int64', na_value=0)
+        order = np.lexsort((listings['date'].to_numpy(), ids))
+        last = np.append(ids[order][1:] != ids[order][:-1], True) | missing[order]
+        self.rows = np.sort(order[last])
+
+        # Missing values rank last
+        for col in RANK_COLUMNS:
+            if col in listings.columns:
+                values = listings[col].to_numpy(dtype='float64', na_value=np.nan)[self.rows]
+                self.rank_values[col] = np.where(np.isnan(values), -np.inf, values)
+
+        for number, col in enumerate(columns):
+            values = listings[col].iloc[self.rows]
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype('category')
+            codes = values.cat.codes.to_numpy()
+            self.columns.append(ColumnPostings(codes, len(values.cat.categories)))
+            for code, text in enumerate(values.cat.categories):
+                for token in set(tokenize(text)):
+                    self.postings.setdefault(token, {}).setdefault(number, []).append(code)
+        for columns_codes in self.postings.values():
+            for number, codes in columns_codes.items():
+                columns_codes[number] = np.array(codes, dtype='int32')
+        self.tokens = sorted(self.postings)
+        self.nbytes = self.measure()
+
+    def matching_tokens(self, token):
+        # Tokens shorter than SEARCH_MIN_PREFIX only match exactly, they would be a prefix of too much
+        if len(token) < config.SEARCH_MIN_PREFIX:
+            return [token] if token in self.postings else []
+        start = bisect_left(self.tokens, token)
+        stop = bisect_left(self.tokens, token + '\U0010ffff', lo=start)
+        return self.tokens[start:stop]
+
+    def candidates(self, query):
+        # Positions into self.rows of the listings matching every query token in any column
+        matches = None
+        for token in dict.fromkeys(tokenize(query)):
+            by_column = {}
+            for indexed in self.matching_tokens(token):
+                for number, codes in self.postings[indexed].items():
+                    by_column.setdefault(number, []).append(codes)
+            rows = [self.columns[number].rows(np.concatenate(codes)) for number, codes in by_column.items()]
+            rows = np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype='int32')
+            matches = rows if matches is None else np.intersect1d(matches, rows, assume_unique=True)
+            if len(matches) == 0:
+                break
+        return matches
+
+    def search(self, query, rank_by='review_scores_rating', limit=None):
+        # Top matches by rank_by, highest first and missing values last
+        limit = limit or config.SEARCH_RESULTS
+        columns = [col for col in RESULT_COLUMNS if col in self.listings.columns]
+        matches = self.candidates(query)
+        if matches is None or len(matches) == 0:
+            return self.listings.iloc[:0][columns]
+
+        positions = self.rows[matches]
+        values = self.rank_values.get(rank_by, self.rank_values[RANK_COLUMNS[0]])[matches]
+        if len(values) > limit:
+            top = np.argpartition(-values, limit - 1)[:limit]
+        else:
+            top = np.arange(len(values))
+        top = top[np.argsort(-values[top], kind='stable')]
+        column_positions = [self.listings.columns.get_loc(col) for col in columns]
+        return self.listings.iloc[positions[top], column_positions]
+
+    def measure(self):
+        # Arrays plus an estimate of the vocabulary and its posting dicts
+        postings = sum(sys.getsizeof(columns_codes) + sum(codes.nbytes + 112 for codes in columns_codes.values())
+                       for columns_codes in self.postings.values())
+        vocabulary = sum(sys.getsizeof(token) for token in self.tokens)
+        return int(self.rows.nbytes + sum(column.nbytes for column in self.columns)
+                   + sum(values.nbytes for values in self.rank_values.values()) + postings + vocabulary)
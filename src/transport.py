@@ -0,0 +1,151 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from dash.fingerprint import check_fingerprint
+from flask import Response, request
+import config
+
+try:
+    import brotli
+except ImportError:  # optional, responses are gzipped without it
+    brotli = None
+
+# Opt-in response compression and validators for app.server (config.COMPRESSION_ENABLED).
+# Callback responses are POSTs, which browsers never revalidate, so they are compressed as they are
+# and get no ETag. Component bundles are keyed by Dash's fingerprinted URL (or the ETag Dash gives
+# unfingerprinted ones) rather than by hashing their bodies. Other GET responses get ETags and 304s.
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/geo+json', 'image/svg+xml')
+
+def is_compressible(mimetype):
+    return mimetype is not None and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def choose_encoding(accept_encodings):
+    if brotli is not None and 'br' in accept_encodings:
+        return 'br'
+    if 'gzip' in accept_encodings:
+        return 'gzip'
+    return None
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=config.BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=config.GZIP_LEVEL)
+
+class CompressedBodies:
+    # LRU of compressed bodies keyed by content hash and encoding
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest, encoding, body):
+        key = (digest, encoding)
+        with self._lock:
+            if key in self._bodies:
+                self._bodies.move_to_end(key)
+                return self._bodies[key]
+        compressed = compress(body, encoding)
+        with self._lock:
+            self._bodies[key] = compressed
+            while len(self._bodies) > self.maxsize:
+                self._bodies.popitem(last=False)
+        return compressed
+
+class StaticFiles:
+    # Contents and hashes of the files in assets/, reread when a file changes
+    def __init__(self, folder):
+        self.folder = os.path.realpath(folder)
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def get(self, relative_path):
+        path = os.path.realpath(os.path.join(self.folder, relative_path))
+        if not path.startswith(self.folder + os.sep) or not os.path.isfile(path):
+            return None
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._files.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+        with open(path, 'rb') as file:
+            body = file.read()
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        with self._lock:
+            self._files[path] = (mtime, body, digest)
+        return body, digest
+
+def register_transport(app):
+    server = app.server
+    assets_prefix = app.config.routes_pathname_prefix + app.config.assets_url_path.strip('/') + '/'
+    suites_prefix = app.config.routes_pathname_prefix + '_dash-component-suites/'
+    static_files = StaticFiles(app.config.assets_folder)
+    bodies = CompressedBodies(config.COMPRESSED_CACHE_SIZE)
+
+    # Assets are compressed up front, so their first request costs no more than the later ones
+    for root, _, names in os.walk(static_files.folder):
+        for name in names:
+            relative_path = os.path.relpath(os.path.join(root, name), static_files.folder)
+            if is_compressible(mimetypes.guess_type(name)[0]):
+                body, digest = static_files.get(relative_path)
+                for encoding in ('br', 'gzip') if brotli is not None else ('gzip',):
+                    bodies.get(digest, encoding, body)
+
+    @server.after_request
+    def compress_response(response):
+        if response.status_code != 200 or 'Content-Encoding' in response.headers:
+            return response
+
+        is_asset = request.path.startswith(assets_prefix)
+        if is_asset:
+            # Dash links assets with a ?m=<mtime> query, those URLs never change content
+            if 'm' in request.args:
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = config.ASSET_MAX_AGE
+                response.cache_control.immutable = True
+            else:
+                response.cache_control.no_cache = True
+            asset = static_files.get(request.path[len(assets_prefix):])
+            if asset is None:
+                return response
+            body, key = asset
+            etag = key
+        elif response.is_streamed:
+            return response  # streamed downloads are sent as they are generated
+        elif not is_compressible(response.mimetype):
+            return response
+        else:
+            body = response.get_data()
+            etag = None
+            if request.path.startswith(suites_prefix):
+                # The fingerprint carries the package version and mtime, Dash validates the others itself
+                key = request.path if check_fingerprint(request.path)[1] else response.get_etag()[0]
+            elif request.method in ('GET', 'HEAD'):
+                key = etag = hashlib.sha1(body).hexdigest()[:16]
+            else:
+                key = None  # callback POSTs are compressed per response, without hashing
+
+        compressible = is_compressible(response.mimetype) and len(body) >= config.COMPRESSION_MIN_BYTES
+        if compressible:
+            response.vary.add('Accept-Encoding')
+        if etag is not None:
+            response.set_etag(etag, weak=True)
+            if request.method in ('GET', 'HEAD') and request.if_none_match.contains_weak(etag):
+                not_modified = Response(status=304)
+                for header in ('ETag', 'Cache-Control', 'Vary'):
+                    if header in response.headers:
+                        not_modified.headers[header] = response.headers[header]
+                return not_modified
+
+        encoding = choose_encoding(request.accept_encodings)
+        if not compressible or encoding is None:
+            return response
+
+        response.direct_passthrough = False
+        response.set_data(bodies.get(key, encoding, body) if key is not None else compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -1,60 +1,93 @@
+import os
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-from dash import dcc, html
+from dash import dcc, html, dash_table
 import config
+from src.listings_cache import read_cached_dates, write_date_manifest
+from src.geojson_assets import geojson_url
+from src.forecast import FORECAST_COLUMNS
+from src.metrics import phase
 
 def get_city_options(city_paths):
     return [{'label': city, 'value': city} for city in city_paths.keys()]
 
-def get_unique_dates(city_paths):
+def get_unique_dates(city_paths, listings_data=None):
+    # Prefer the date manifest written next to the listings cache, then frames that are already loaded
     unique_dates = []
     for city, paths in city_paths.items():
-        listings = pd.read_csv(paths['listings'], encoding='utf-8', parse_dates=['date'])
-        unique_dates.extend(listings['date'].unique())
+        if not os.path.exists(paths['listings']):
+            continue
+        dates = read_cached_dates(paths['listings'])
+        if dates is None and listings_data is not None and city in listings_data:
+            dates = listings_data[city]['date'].unique()
+        if dates is None:
+            try:
+                with open(paths['listings'], 'r', encoding='utf-8', errors='replace') as file:
+                    dates = pd.read_csv(file, usecols=['date'], parse_dates=['date'])['date'].unique()
+            except ValueError as e:
+                print(f"Could not read dates for {city} from {paths['listings']}: {e}")
+                continue
+            # The next start (and every refresh) reads the manifest instead of scanning the CSV again
+            if config.CACHE_WRITE_ON_MISS:
+                try:
+                    write_date_manifest(paths['listings'], dates)
+                except OSError as e:
+                    print(f"Could not write the date manifest for {city}: {e}")
+        unique_dates.extend(dates)
     unique_dates = pd.to_datetime(unique_dates).drop_duplicates().sort_values()
     return unique_dates
 
-def update_map(selected_city, selected_month, is_forecasted, city_paths, neighborhoods_geojson, neighborhood_stats):
-    if selected_city not in city_paths:
+def get_date_marks(unique_dates):
+    return {i: date.strftime('%Y-%m') for i, date in enumerate(sorted(unique_dates))}
+
+MAP_VIEWS = {
+    'Madrid, Spain': ({"lat": 40.472775, "lon": -3.703790}, 9.80),
+    'Barcelona, Spain': ({"lat": 41.389785, "lon": 2.166775}, 10.9),
+    'Mallorca, Spain': ({"lat": 39.695262, "lon": 3.017571}, 8.85),
+    'Florence, Italy': ({"lat": 43.769562, "lon": 11.255814}, 11.0),
+    'Milan, Italy': ({"lat": 45.464204, "lon": 9.189982}, 10.8),
+    'Rome, Italy': ({"lat": 41.902782, "lon": 12.496366}, 9.6),
+    'Lisbon, Portugal': ({"lat": 38.936946, "lon": -9.242685}, 9.0),
+    'Porto, Portugal': ({"lat": 41.157944, "lon": -8.629105}, 8.9),
+}
+
+def update_map(selected_city, selected_month, is_forecasted, city_paths, neighborhoods_geojson, neighborhood_stats, figure_cache=None, data_version=None):
+    if selected_city not in city_paths or selected_city not in MAP_VIEWS or selected_city not in neighborhood_stats:
         return html.Div("Invalid city selected")
-    
+
+    def build():
+        with phase('figure'):
+            return create_map_figure(selected_city, selected_month, is_forecasted, neighborhoods_geojson, neighborhood_stats, data_version)
+
+    def build_json():
+        figure = build()
+        with phase('serialise'):
+            return figure.to_json()
+
+    # There are only cities x months x forecast-flag distinct maps per data version, so built figures are reused
+    if figure_cache is not None:
+        figure = figure_cache.get_or_build((selected_city, selected_month, is_forecasted, data_version), build_json)
+    else:
+        figure = build()
+
+    return dcc.Graph(
+        id='map',
+        figure=figure,
+        style={'width': '100%', 'height': '750px', 'borderRadius': '10px', 'boxShadow': '0px 4px 10px rgba(0, 0, 0, 0.1)'}
+    )
+
+def create_map_figure(selected_city, selected_month, is_forecasted, neighborhoods_geojson, neighborhood_stats, data_version=None):
+    import plotly.express as px  # imported on the first map build, it is slow to import and only used here
     neighborhoods_geojson_selected = neighborhoods_geojson[selected_city]
+    if config.MAP_GEOJSON_MODE == 'url':
+        neighborhoods_geojson_selected = geojson_url(selected_city, neighborhoods_geojson_selected, data_version)
     neighborhood_stats_selected = neighborhood_stats[selected_city]
     
     # Filter by the selected month
-    neighborhood_stats_filtered = neighborhood_stats_selected[neighborhood_stats_selected['month'] == selected_month]
+    with phase('filter'):
+        neighborhood_stats_filtered = neighborhood_stats_selected[neighborhood_stats_selected['month'] == selected_month]
    
-    # Determine the year based on the selected month
-    # Assuming that you have a date column or month can be translated into a specific year
-    year = 2024  # Adjust this as needed
-
-    if selected_city == 'Madrid, Spain':
-        center = {"lat": 40.472775, "lon": -3.703790}
-        zoom_level = 9.80
-    elif selected_city == 'Barcelona, Spain':
-        center = {"lat": 41.389785, "lon": 2.166775}
-        zoom_level = 10.9
-    elif selected_city == 'Mallorca, Spain':
-        center = {"lat": 39.695262, "lon": 3.017571}
-        zoom_level = 8.85
-    elif selected_city == 'Florence, Italy':
-        center = {"lat": 43.769562, "lon": 11.255814}
-        zoom_level = 11.0
-    elif selected_city == 'Milan, Italy':
-        center = {"lat": 45.464204, "lon": 9.189982}
-        zoom_level = 10.8
-    elif selected_city == 'Rome, Italy':
-        center = {"lat": 41.902782, "lon": 12.496366}
-        zoom_level = 9.6
-    elif selected_city == 'Lisbon, Portugal':
-        center = {"lat": 38.936946, "lon": -9.242685}
-        zoom_level = 9.0
-    elif selected_city == 'Porto, Portugal':
-        center = {"lat": 41.157944, "lon": -8.629105}
-        zoom_level = 8.9
-    else:
-        return html.Div("Invalid city selected")
+    center, zoom_level = MAP_VIEWS[selected_city]
 
     # Conditional hover data depending on the date
     hover_data = {
@@ -66,6 +99,11 @@ def update_map(selected_city, selected_month, is_forecasted, city_paths, neighbo
             'avg_ratings': ':.2f',
             'name': True
         })
+    elif 'price_lower' in neighborhood_stats_filtered.columns:
+        hover_data.update({
+            'price_lower': ':.2f',
+            'price_upper': ':.2f'
+        })
 
     fig = px.choropleth_mapbox(
         neighborhood_stats_filtered,
@@ -84,6 +122,8 @@ def update_map(selected_city, selected_month, is_forecasted, city_paths, neighbo
             'neighbourhood_cleansed': 'Neighborhood',
             'avg_ratings': 'Average Ratings',
             'name': 'Number of Listings',
+            'price_lower': 'Lower Bound',
+            'price_upper': 'Upper Bound',
         }
     )
 
@@ -116,12 +156,132 @@ def update_map(selected_city, selected_month, is_forecasted, city_paths, neighbo
         )
     )
 
-    return dcc.Graph(
-        id='map',
-        figure=fig,
-        style={'width': '100%', 'height': '750px', 'borderRadius': '10px', 'boxShadow': '0px 4px 10px rgba(0, 0, 0, 0.1)'}
+    return fig
+
+def create_series_figure(listings_aggregated, column, label, selected_neighborhood, color, forecast_color, forecast=None):
+    if forecast is None:
+        # Without precomputed forecasts the last two months of the data are shown as the forecast
+        forecast_start_index = -2  # Start of forecasted months
+        forecast_dates = listings_aggregated['date'][forecast_start_index:]
+        forecast_values = listings_aggregated[column][forecast_start_index:]
+    else:
+        # The forecast line starts at the last observed point; a metric with too little data has no forecast
+        forecast = forecast[forecast[column].notna()]
+        forecast_dates = pd.concat([listings_aggregated['date'][-1:], forecast['date']], ignore_index=True)
+        forecast_values = pd.concat([listings_aggregated[column][-1:], forecast[column]], ignore_index=True)
+
+    fig = go.Figure()
+
+    # Add trace for all data points including the connection to the forecasted months
+    fig.add_trace(go.Scatter(
+        x=listings_aggregated['date'],
+        y=listings_aggregated[column],
+        mode='lines',  # Connect all points with a line
+        name=f'Mean {label}',
+        line=dict(color=color),  # Original color
+        marker=dict(color=color, size=8)
+    ))
+
+    # Add a trace for the forecasted points with a different color
+    fig.add_trace(go.Scatter(
+        x=forecast_dates,
+        y=forecast_values,
+        mode='markers+lines',
+        name=f'Forecasted {label}',
+        line=dict(color=forecast_color),  # Forecasted color
+        marker=dict(color=forecast_color, size=8)
+    ))
+
+    if forecast is not None and not forecast.empty:
+        # Prediction interval as a band around the forecast
+        lower, upper = FORECAST_COLUMNS[column]
+        fig.add_trace(go.Scatter(
+            x=pd.concat([forecast['date'], forecast['date'][::-1]], ignore_index=True),
+            y=pd.concat([forecast[upper], forecast[lower][::-1]], ignore_index=True),
+            fill='toself',
+            mode='lines',
+            line=dict(width=0, color=forecast_color),
+            opacity=0.25,
+            hoverinfo='skip',
+            name=f'{config.FORECAST_LEVEL:.0%} Interval'
+        ))
+    tick_dates = listings_aggregated['date'] if forecast is None else pd.concat([listings_aggregated['date'], forecast['date']], ignore_index=True)
+
+    fig.update_layout(
+        title=f'{label} Over Time in {selected_neighborhood}',
+        xaxis_title='Date',
+        yaxis_title=label,
+        xaxis=dict(
+            showgrid=True,
+            zeroline=False,
+            tickmode='array',
+            tickvals=tick_dates,
+            ticktext=[date.strftime('%Y-%m') for date in tick_dates],
+            gridcolor='rgba(0,0,0,0.3)',
+            gridwidth=1,
+        ),
+        yaxis=dict(
+            showgrid=True,
+            zeroline=False,
+            gridcolor='rgba(0,0,0,0.3)',
+            gridwidth=1,
+        ),
+        template='plotly',
+        margin=dict(l=40, r=40, t=40, b=40),
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        xaxis_showspikes=False,
+        yaxis_showspikes=False,
+        xaxis_showline=True,
+        yaxis_showline=True,
+        xaxis_linecolor='black',
+        yaxis_linecolor='black',
+        xaxis_linewidth=2,
+        yaxis_linewidth=2,
     )
 
+    return fig
+
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+def create_comparison_figure(summary, bin_columns, bin_labels):
+    # summary has one row per (city, month) with averages, listing counts and price histogram counts
+    from plotly.subplots import make_subplots
+    fig = make_subplots(rows=2, cols=2, subplot_titles=['Average Price', 'Average Rating', 'Listings', 'Price Distribution (% of listings)'])
+    if summary is None or summary.empty:
+        return fig
+
+    colors = [config.COLORS['primary'], config.COLORS['accent'], config.COLORS['info'], config.COLORS['dark'], config.COLORS['secondary'], '#7B0051', '#8CE071']
+    for i, (city, rows) in enumerate(summary.groupby(level='city', sort=False)):
+        color = colors[i % len(colors)]
+        months = [MONTH_NAMES[month - 1] for month in rows.index.get_level_values('month')]
+        for row, col, column in ((1, 1, 'avg_price'), (1, 2, 'avg_rating'), (2, 1, 'listings')):
+            fig.add_trace(go.Scatter(x=months, y=rows[column], mode='lines+markers', name=city, legendgroup=city,
+                                     showlegend=column == 'avg_price', line=dict(color=color)), row=row, col=col)
+        # The histogram covers every month of the city
+        counts = rows[bin_columns].sum()
+        fig.add_trace(go.Bar(x=bin_labels, y=100 * counts.to_numpy() / max(counts.sum(), 1), name=city, legendgroup=city,
+                             showlegend=False, marker_color=color), row=2, col=2)
+
+    fig.update_layout(
+        barmode='group',
+        height=700,
+        margin=dict(l=40, r=40, t=60, b=40),
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        legend=dict(orientation='h', y=-0.1),
+    )
+    fig.update_xaxes(showline=True, linecolor='black')
+    fig.update_yaxes(showline=True, linecolor='black', gridcolor='rgba(0,0,0,0.1)')
+    return fig
+
+def to_display_values(dataframe):
+    # float32 columns are widened via their shortest repr so 60.3 is not shown as 60.29999923706055
+    float32_columns = [col for col in dataframe.columns if dataframe[col].dtype == 'float32']
+    if not float32_columns:
+        return dataframe
+    return dataframe.astype({col: str for col in float32_columns}).astype({col: 'float64' for col in float32_columns})
+
 def generate_table(dataframe, width=1000, height=600):
     headerColor = config.COLORS['primary']
     rowEvenColor = config.COLORS['light']
@@ -169,39 +329,41 @@ def generate_table(dataframe, width=1000, height=600):
     
 ####return dcc.Graph(figure=fig)
 
-def get_sort_options(listings_data, selected_city):
-    if selected_city in listings_data:
-        columns = config.DEFAULT_COLUMNS + config.ADDITIONAL_COLUMNS_LIST
-        available_columns = [col for col in columns if col in listings_data[selected_city].columns]
-        return [{'label': config.COLUMN_DISPLAY_NAMES.get(col, col), 'value': col} for col in available_columns]
-    return []
-
-def get_column_options(listings_data, selected_city):
-    if selected_city in listings_data:
-        all_columns = listings_data[selected_city].columns
-        additional_columns = [col for col in config.ADDITIONAL_COLUMNS_LIST if col in all_columns]
-        return [{'label': config.COLUMN_DISPLAY_NAMES.get(col, col), 'value': col} for col in additional_columns]
-    return []
-
-def get_neighborhood_options(listings_data, selected_city):
-    if selected_city in listings_data:
-        neighborhoods = listings_data[selected_city]['neighbourhood_cleansed'].unique()
-        return [{'label': neighborhood, 'value': neighborhood} for neighborhood in neighborhoods]
-    return []
-
-def parse_top_amenities(amenities_str):
-    amenities = amenities_str.split("), ")  # Split by "), " to handle both parts together
-    parsed_data = []
-    
-    for amenity in amenities:
-        try:
-            # Further splitting to remove brackets
-            name, count_percentage = amenity.split(" (")
-            count, percentage = count_percentage.split(", ")
-            count = int(count)
-            percentage = float(percentage.strip('%)'))
-            parsed_data.append((name, count, percentage))
-        except ValueError as e:
-            print(f"Skipping malformed amenity: {amenity} due to error: {e}")
-    
-    return parsed_data
\ No newline at end of file
+def generate_paged_table():
+    return html.Div([
+        html.Div(id='table-row-count', style={'fontSize': '14px', 'marginBottom': '10px', 'color': config.COLORS['secondary']}),
+        dash_table.DataTable(
+            id='listings-table',
+            page_action='custom',
+            page_current=0,
+            page_size=config.TABLE_PAGE_SIZE,
+            page_count=1,
+            style_header={'backgroundColor': config.COLORS['primary'], 'color': 'white', 'fontWeight': 'bold', 'border': 'none'},
+            style_cell={'fontFamily': 'Arial', 'fontSize': '12px', 'color': config.COLORS['text'], 'textAlign': 'left',
+                        'padding': '6px', 'border': f"1px solid {config.COLORS['background']}", 'maxWidth': '320px',
+                        'overflow': 'hidden', 'textOverflow': 'ellipsis'},
+            style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': config.COLORS['background']}],
+        )
+    ])
+
+def get_sort_options(available_columns):
+    columns = config.DEFAULT_COLUMNS + config.ADDITIONAL_COLUMNS_LIST
+    return [{'label': config.COLUMN_DISPLAY_NAMES.get(col, col), 'value': col} for col in columns if col in available_columns]
+
+def get_column_options(available_columns):
+    additional_columns = [col for col in config.ADDITIONAL_COLUMNS_LIST if col in available_columns]
+    return [{'label': config.COLUMN_DISPLAY_NAMES.get(col, col), 'value': col} for col in additional_columns]
+
+def get_neighborhood_options(neighborhoods):
+    return [{'label': neighborhood, 'value': neighborhood} for neighborhood in neighborhoods]
+
+def parse_amenities_column(amenities):
+    # amenities is indexed by neighbourhood, each value like "Wifi (120, 95.5%), Kitchen (100, 80.1%)"
+    entries = amenities.dropna().astype(str).str.split("), ", regex=False).explode()
+    parsed = entries.str.extract(r'^(?P<amenity>[^(]*) \((?P<count>\d+), (?P<percentage>[\d.]+)%?\)?$')
+    malformed = int(parsed['amenity'].isna().sum())
+
+    parsed = parsed.dropna()
+    parsed.index.name = 'neighbourhood_cleansed'
+    parsed = parsed.reset_index().astype({'count': 'int32', 'percentage': 'float64'})
+    return parsed, malformed
@@ -0,0 +1,12 @@
+import config
+
+# Production entry point (gunicorn --config gunicorn.conf.py wsgi:server, or uwsgi --module wsgi:server).
+# Importing it builds the app without loading any data; gunicorn.conf.py starts the data loading when
+# a worker starts, other servers on a worker's first request. Listings are read from the columnar cache,
+# which the first worker builds under a file lock, and every worker maps the same files read-only
+# instead of holding its own copy.
+config.SHARED_DATASET = True
+
+from app import app
+
+server = app.server